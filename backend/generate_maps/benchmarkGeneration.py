@@ -0,0 +1,270 @@
+"""
+This module benchmarks map generation offline against fakeMapServer.py, so
+that throughput can be measured without spending Bing Maps quota and
+regressions in the request, dedup and write path can be spotted.
+
+Each scenario geocodes the city and runs the real generation pipeline
+(localSearch.search_grid(), localSearch.construct_request(),
+generateMapData.retrieve_all() with its deduplication, and mapWriter.MapWriter)
+with a given search grid size and number of business types, and measures:
+    "wallTime": float for the time (s) taken to generate the map file
+    "requests": int count of Local Search requests received by the server
+    "requestsPerSecond": float for requests divided by wall time
+    "peakRss": int for the peak resident set size (bytes) of the scenario, or
+        None if the platform cannot report it
+    "outputBytes": int for the size of the generated map file
+    "mapObjects", "duplicates", "failedRequests", "retries", "hedges": int
+        counts reported by the pipeline
+
+The fake server runs in this process while each scenario runs in its own
+Python process, so peak RSS is measured per scenario and excludes the server.
+Every scenario starts with an empty response cache, and the Bing Maps API rate
+limit is raised to BENCHMARK_QPS so that the pipeline itself is measured.
+
+Global Variables:
+    BENCHMARK_GRIDS: tuple of (LAT_PART, LONG_PART) search grid sizes
+    BENCHMARK_TYPES: tuple of Bing Maps API business type identifiers
+    BENCHMARK_TYPE_COUNTS: tuple of ints for the number of business types
+        (taken from the start of BENCHMARK_TYPES) in each scenario
+    BENCHMARK_BOUNDING_BOX: tuple of 4 floats for the benchmarked city
+    BENCHMARK_QPS: float for the Bing Maps API rate limit while benchmarking
+    BENCHMARK_KEYS: int for the number of Bing Maps API keys while
+        benchmarking
+    STUB_DENSITY: int for the businesses generated per business type
+    STUB_LATENCY: float for the mean response latency (s) of the fake server
+    STUB_LATENCY_JITTER: float for the standard deviation of the response
+        latency (s) of the fake server
+    STUB_ERROR_RATE: float for the fraction of requests answered with 500
+    STUB_THROTTLE_RATE: float for the fraction of requests answered with 429
+    BASELINE_PATH: string for file path of the stored benchmark baseline
+    REGRESSION_TOLERANCE: float for the fraction a metric may worsen by
+        relative to the baseline before it is reported as a regression
+
+Functions:
+    run_scenario: runs a single scenario in the current process
+    run_benchmark: runs every scenario against a fake server
+    compare_baseline: compares benchmark results with the stored baseline
+
+When invoked directly, every scenario is run and compared with the stored
+baseline, exiting with status 1 if any metric regressed.
+
+Arguments:
+    save: optional, stores the results as the new baseline instead
+"""
+from asyncio import create_subprocess_exec, run
+from asyncio.subprocess import PIPE
+from fakeMapServer import FakeMapServer, LOCAL_SEARCH_PATH, NOMINATIM_PATH
+from json import dump, dumps, load, loads
+from mapWriter import MapWriter
+from os.path import dirname, getsize, join
+from responseCache import open_cache
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import generateMapData
+import geocoder
+import localSearch
+import sys
+
+try:
+    from resource import RUSAGE_SELF, getrusage
+except ImportError:
+    getrusage = None
+
+
+BENCHMARK_GRIDS = ((2, 3), (4, 6), (8, 12))
+BENCHMARK_TYPES = ('Restaurants', 'Bars', 'Pizza', 'Museums', 'Parks',
+                   'Bookstores')
+BENCHMARK_TYPE_COUNTS = (1, 3, 6)
+BENCHMARK_BOUNDING_BOX = (40.0, -75.0, 40.3, -74.6)
+BENCHMARK_QPS = 10000
+BENCHMARK_KEYS = 1
+STUB_DENSITY = 1500
+STUB_LATENCY = 0.01
+STUB_LATENCY_JITTER = 0.005
+STUB_ERROR_RATE = 0.01
+STUB_THROTTLE_RATE = 0.02
+BASELINE_PATH = join(dirname(__file__), 'benchmarkBaseline.json')
+REGRESSION_TOLERANCE = 0.2
+
+# Metrics compared with the baseline, and whether larger values are better
+COMPARED_METRICS = {
+    'wallTime': False,
+    'requestsPerSecond': True,
+    'peakRss': False,
+    'outputBytes': False
+}
+
+
+def peak_rss():
+    if getrusage is None:
+        return None
+    # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def scenario_name(scenario):
+    lat_part, long_part = scenario['grid']
+    return f"{lat_part}x{long_part} grid, {len(scenario['types'])} types"
+
+
+async def run_scenario(scenario, server_url):
+    """
+    Runs a single scenario in the current process against a running fake
+    server. Module globals of the pipeline are overridden, so this should be
+    run in a dedicated process.
+
+    Args:
+        scenario: dictionary with keys "grid" (LAT_PART and LONG_PART) and
+            "types" (business type identifiers).
+        server_url: string for the base url of the fake server.
+
+    Returns:
+        A dictionary of the scenario metrics measured in this process.
+    """
+    with TemporaryDirectory() as work_path:
+        localSearch.LOCAL_SEARCH_URL = server_url + LOCAL_SEARCH_PATH
+        geocoder.NOMINATIM_URL = server_url + NOMINATIM_PATH
+        generateMapData.LAT_PART, generateMapData.LONG_PART = scenario['grid']
+        generateMapData.QPS_LIMIT = BENCHMARK_QPS
+        generateMapData.bing_maps_keys = [
+            f'benchmark{index}' for index in range(BENCHMARK_KEYS)]
+        generateMapData.response_cache = open_cache(
+            join(work_path, 'responseCache.db'))
+
+        map_path = join(work_path, 'benchmark.json')
+        async with generateMapData.open_session() as session:
+            start = perf_counter()
+            place = await geocoder.geocode(
+                'Benchmark', 'Benchmark', session,
+                generateMapData.response_cache,
+                generateMapData.CACHE_MAX_BYTES)
+            with MapWriter(map_path) as writer:
+                job = generateMapData.MapJob(
+                    scenario['types'], place['bounding_box'], writer,
+                    generateMapData.retrieve_boundary(place))
+                await generateMapData.retrieve_all(job, session)
+            wall_time = perf_counter() - start
+
+        scheduler = generateMapData.retrieve_scheduler()
+        metrics = {
+            'wallTime': wall_time,
+            'peakRss': peak_rss(),
+            'outputBytes': getsize(map_path),
+            'mapObjects': writer.count,
+            'duplicates': job.dedup.duplicates,
+            'failedRequests': len(job.failed_requests),
+            'retries': scheduler.retries,
+            'hedges': scheduler.hedges
+        }
+        generateMapData.response_cache.close()
+        return metrics
+
+
+async def run_benchmark():
+    """
+    Runs every combination of BENCHMARK_GRIDS and BENCHMARK_TYPE_COUNTS
+    against a fake server, each in its own process.
+
+    Returns:
+        A dictionary mapping scenario names to scenario metrics.
+    """
+    server = FakeMapServer(BENCHMARK_BOUNDING_BOX,
+                           STUB_DENSITY,
+                           latency=STUB_LATENCY,
+                           latency_jitter=STUB_LATENCY_JITTER,
+                           error_rate=STUB_ERROR_RATE,
+                           throttle_rate=STUB_THROTTLE_RATE)
+    await server.start()
+
+    results = {}
+    try:
+        for grid in BENCHMARK_GRIDS:
+            for type_count in BENCHMARK_TYPE_COUNTS:
+                scenario = {
+                    'grid': grid,
+                    'types': BENCHMARK_TYPES[:type_count]
+                }
+                requests = server.requests
+                process = await create_subprocess_exec(
+                    sys.executable, __file__, 'scenario', dumps(scenario),
+                    server.url, stdout=PIPE)
+                output, _ = await process.communicate()
+                if process.returncode != 0:
+                    raise RuntimeError(
+                        f"Scenario {scenario_name(scenario)} failed")
+
+                metrics = loads(output.decode().splitlines()[-1])
+                metrics['requests'] = server.requests - requests
+                metrics['requestsPerSecond'] = (metrics['requests'] /
+                                                metrics['wallTime'])
+                results[scenario_name(scenario)] = metrics
+                print(scenario_name(scenario), metrics, file=sys.stderr)
+    finally:
+        await server.stop()
+    return results
+
+
+def compare_baseline(results, baseline):
+    """
+    Compares benchmark results with a baseline.
+
+    Args:
+        results: dictionary returned by run_benchmark().
+        baseline: dictionary returned by run_benchmark() for the baseline.
+
+    Returns:
+        A list of strings describing each metric that worsened by more than
+        REGRESSION_TOLERANCE. Scenarios missing from the baseline are skipped.
+    """
+    regressions = []
+    for name, metrics in results.items():
+        if name not in baseline:
+            continue
+        for metric, larger_is_better in COMPARED_METRICS.items():
+            current = metrics.get(metric)
+            previous = baseline[name].get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if larger_is_better:
+                change = -change
+            if change > REGRESSION_TOLERANCE:
+                regressions.append(f"{name}: {metric} {previous:.6g} -> " +
+                                   f"{current:.6g}")
+    return regressions
+
+
+def main():
+    results = run(run_benchmark())
+    print(dumps(results, indent=4))
+
+    if sys.argv[1:2] == ['save']:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as baseline_file:
+            dump(results, baseline_file, indent=4)
+        print("Stored baseline")
+        return
+
+    try:
+        with open(BASELINE_PATH, 'r', encoding='utf-8') as baseline_file:
+            baseline = load(baseline_file)
+    except FileNotFoundError:
+        print("No baseline stored, run with argument save to store one")
+        return
+
+    regressions = compare_baseline(results, baseline)
+    for regression in regressions:
+        print("Regression", regression)
+    if regressions:
+        sys.exit(1)
+    print("No regressions")
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['scenario']:
+        # Progress messages go to stderr so that stdout only holds metrics
+        stdout, sys.stdout = sys.stdout, sys.stderr
+        metrics = run(run_scenario(loads(sys.argv[2]), sys.argv[3]))
+        print(dumps(metrics), file=stdout)
+    else:
+        main()
@@ -0,0 +1,191 @@
+"""
+This module contains methods to assist with restricting map generation to the
+boundary polygon of a city, as returned by the Nominatim API with
+polygon_geojson=1.
+
+Search grids are clipped to the boundary before they are requested: grids that
+do not intersect the boundary are skipped, and grids that partially intersect
+it are shrunk to the bounding box of the intersection. Retrieved businesses
+outside the boundary are discarded.
+
+Point lookups use a slab index: the boundary's latitude range is split into
+SLAB_COUNT horizontal slabs, each holding only the edges that cross it, so a
+lookup only tests the edges of one slab rather than every edge.
+
+Global Variables:
+    SLAB_COUNT: int for the number of horizontal slabs in the point index
+
+Functions:
+    parse_geojson: converts a GeoJSON geometry into a list of polygons
+
+Classes:
+    Boundary: city boundary supporting point lookups and grid clipping
+"""
+from math import floor
+
+
+SLAB_COUNT = 256
+
+
+def parse_geojson(geojson):
+    """
+    Converts a GeoJSON Polygon or MultiPolygon geometry into a list of
+    polygons.
+
+    Args:
+        geojson: dictionary created from a GeoJSON geometry.
+
+    Returns:
+        A list of polygons, each a list of rings (the outer ring first, then
+        any holes), each a list of (latitude, longitude) tuples. Returns an
+        empty list for other geometry types.
+    """
+    if not geojson:
+        return []
+    if geojson.get('type') == 'Polygon':
+        polygons = [geojson['coordinates']]
+    elif geojson.get('type') == 'MultiPolygon':
+        polygons = geojson['coordinates']
+    else:
+        return []
+
+    return [
+        [[(lat, long) for long, lat, *_ in ring] for ring in polygon]
+        for polygon in polygons
+    ]
+
+
+def clip_ring(ring, grid):
+    """
+    Clips a ring to a rectangular grid with the Sutherland-Hodgman algorithm.
+    Returns the clipped ring, which is empty if they do not intersect.
+    """
+    sw_lat, sw_long, ne_lat, ne_long = grid
+    edges = (
+        (lambda point: point[0] >= sw_lat, 0, sw_lat),
+        (lambda point: point[0] <= ne_lat, 0, ne_lat),
+        (lambda point: point[1] >= sw_long, 1, sw_long),
+        (lambda point: point[1] <= ne_long, 1, ne_long)
+    )
+
+    for inside, axis, value in edges:
+        if not ring:
+            break
+        clipped = []
+        previous = ring[-1]
+        for point in ring:
+            if inside(point):
+                if not inside(previous):
+                    clipped.append(intersect(previous, point, axis, value))
+                clipped.append(point)
+            elif inside(previous):
+                clipped.append(intersect(previous, point, axis, value))
+            previous = point
+        ring = clipped
+    return ring
+
+
+def intersect(start, end, axis, value):
+    ratio = (value - start[axis]) / (end[axis] - start[axis])
+    point = [start[0] + ratio * (end[0] - start[0]),
+             start[1] + ratio * (end[1] - start[1])]
+    point[axis] = value
+    return tuple(point)
+
+
+class Boundary:
+    """
+    City boundary made of one or more polygons with optional holes.
+
+    Attributes:
+        polygons: list of polygons as returned by parse_geojson()
+        bounding_box: tuple of 4 floats specifying the bounding box of the
+            boundary, in the same order as localSearch.search_grid()
+    """
+
+    def __init__(self, polygons):
+        """
+        Args:
+            polygons: list of polygons as returned by parse_geojson(). Must
+                not be empty.
+
+        Raises:
+            ValueError: if polygons is empty.
+        """
+        if not polygons:
+            raise ValueError("Boundary must contain at least one polygon")
+
+        self.polygons = polygons
+        points = [point for polygon in polygons for point in polygon[0]]
+        self.bounding_box = (
+            min(point[0] for point in points),
+            min(point[1] for point in points),
+            max(point[0] for point in points),
+            max(point[1] for point in points)
+        )
+
+        # Every ring edge is added to each slab its latitude range crosses
+        self.slab_height = ((self.bounding_box[2] - self.bounding_box[0]) /
+                            SLAB_COUNT) or 1
+        self.slabs = [[] for _ in range(SLAB_COUNT)]
+        for polygon in polygons:
+            for ring in polygon:
+                previous = ring[-1]
+                for point in ring:
+                    low = min(previous[0], point[0])
+                    high = max(previous[0], point[0])
+                    for slab in range(self.slab_for(low),
+                                      self.slab_for(high) + 1):
+                        self.slabs[slab].append((previous, point))
+                    previous = point
+
+    def slab_for(self, lat):
+        slab = floor((lat - self.bounding_box[0]) / self.slab_height)
+        return min(max(slab, 0), SLAB_COUNT - 1)
+
+    def contains(self, lat, long):
+        """
+        Returns True if a coordinate is inside the boundary and False if not.
+        Holes and overlapping polygons follow the even-odd rule.
+        """
+        sw_lat, sw_long, ne_lat, ne_long = self.bounding_box
+        if not (sw_lat <= lat <= ne_lat and sw_long <= long <= ne_long):
+            return False
+
+        inside = False
+        for start, end in self.slabs[self.slab_for(lat)]:
+            if (start[0] > lat) != (end[0] > lat):
+                crossing = (start[1] + (lat - start[0]) *
+                            (end[1] - start[1]) / (end[0] - start[0]))
+                if long < crossing:
+                    inside = not inside
+        return inside
+
+    def clip(self, grid):
+        """
+        Clips a search grid to the boundary.
+
+        Args:
+            grid: a list or tuple of 4 floats in the same order as
+                localSearch.search_grid().
+
+        Returns:
+            A tuple of 4 floats for the bounding box of the intersection of
+            grid and the boundary, or None if they do not intersect. Holes are
+            ignored, so the result may be larger than necessary but never
+            misses part of the boundary.
+        """
+        clipped_points = []
+        for polygon in self.polygons:
+            clipped_points.extend(clip_ring(polygon[0], grid))
+
+        if not clipped_points:
+            return None
+
+        sw_lat = min(point[0] for point in clipped_points)
+        sw_long = min(point[1] for point in clipped_points)
+        ne_lat = max(point[0] for point in clipped_points)
+        ne_long = max(point[1] for point in clipped_points)
+        if sw_lat >= ne_lat or sw_long >= ne_long:
+            return None
+        return (sw_lat, sw_long, ne_lat, ne_long)
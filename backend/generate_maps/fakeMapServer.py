@@ -0,0 +1,255 @@
+"""
+This module contains a local stand-in for the Bing Maps Local Search API and
+the Nominatim API, used to benchmark map generation without spending Bing Maps
+quota or depending on network conditions.
+
+The server answers Local Search requests with the same resourceSets[0].resources
+schema as the real API, so responses go through localSearch.parse_locations()
+unchanged. Businesses are generated once per business type from a seed: half
+are spread evenly over the city and half are clustered around its center, so
+that dense grids come back saturated and get refined as they would for a real
+city. Each response returns at most maxResults of the businesses inside the
+requested userMapView, interleaving the business types of requests for several
+types. Like the real API, results carry a singular entity type ("Restaurant")
+rather than the requested type ID ("Restaurants").
+
+Nominatim requests return a single place whose bounding box is the city and
+whose boundary is an octagon inscribed in it, so that boundary clipping is
+exercised as well.
+
+Global Variables:
+    BUCKET_DIVISIONS: int for the number of buckets per side of the index
+        used to look up the businesses inside a userMapView
+    ENTITY_TYPES: dictionary mapping type IDs to the entity type of their
+        results, for type IDs whose entity type is not their singular form
+    LOCAL_SEARCH_PATH: string for the url path of the Local Search API
+    NOMINATIM_PATH: string for the url path of the Nominatim API
+
+Classes:
+    FakeMapServer: local Local Search and Nominatim API server
+"""
+from aiohttp import web
+from asyncio import sleep
+from math import floor
+from random import Random
+
+
+BUCKET_DIVISIONS = 64
+ENTITY_TYPES = {
+    'EatDrink': 'Restaurant',
+    'SeeDo': 'Attraction',
+    'Shop': 'Store',
+    'Pizza': 'Pizza',
+    'BanksAndCreditUnions': 'Bank',
+    'HotelsAndMotels': 'Hotel',
+    'Parking': 'Parking'
+}
+LOCAL_SEARCH_PATH = '/REST/v1/LocalSearch/'
+NOMINATIM_PATH = '/search.php'
+
+
+class FakeMapServer:
+    """
+    Local Local Search and Nominatim API server running on the current event
+    loop.
+
+    Attributes:
+        url: string for the base url of the server once started
+        requests: int count of Local Search requests received
+        throttled: int count of Local Search requests answered with 429
+        errors: int count of Local Search requests answered with 500
+        key_requests: dictionary mapping each API key to the int count of
+            Local Search requests made with it
+    """
+
+    def __init__(self,
+                 bounding_box,
+                 density,
+                 latency=0.02,
+                 latency_jitter=0.01,
+                 error_rate=0,
+                 throttle_rate=0,
+                 rejected_keys=(),
+                 seed=0):
+        """
+        Args:
+            bounding_box: a list or tuple of 4 floats specifying the city, in
+                the same order as localSearch.search_grid().
+            density: int representing the number of businesses generated for
+                each business type.
+            latency: float representing the mean response latency (s).
+            latency_jitter: float representing the standard deviation of the
+                response latency (s).
+            error_rate: float representing the fraction of Local Search
+                requests answered with status 500.
+            throttle_rate: float representing the fraction of Local Search
+                requests answered with status 429.
+            rejected_keys: a list or tuple of strings for API keys whose
+                Local Search requests are answered with status 401.
+            seed: int seeding the generated businesses and responses.
+        """
+        self.bounding_box = tuple(bounding_box)
+        self.density = density
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rejected_keys = set(rejected_keys)
+        self.seed = seed
+        self.random = Random(seed)
+        self.buckets = {}
+        self.url = None
+        self.runner = None
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.key_requests = {}
+
+    async def start(self, host='127.0.0.1', port=0):
+        """
+        Starts the server. Uses a free port unless port is provided.
+        """
+        app = web.Application()
+        app.router.add_get(LOCAL_SEARCH_PATH, self.local_search)
+        app.router.add_get(NOMINATIM_PATH, self.nominatim)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f'http://{host}:{port}'
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def bucket_for(self, lat, long):
+        sw_lat, sw_long, ne_lat, ne_long = self.bounding_box
+        row = floor((lat - sw_lat) / (ne_lat - sw_lat) * BUCKET_DIVISIONS)
+        column = floor(
+            (long - sw_long) / (ne_long - sw_long) * BUCKET_DIVISIONS)
+        return (min(max(row, 0), BUCKET_DIVISIONS - 1),
+                min(max(column, 0), BUCKET_DIVISIONS - 1))
+
+    def businesses_for(self, business_type):
+        """
+        Returns the bucketed businesses of a business type, generating them
+        on first use.
+        """
+        if business_type in self.buckets:
+            return self.buckets[business_type]
+
+        rng = Random(f'{self.seed}:{business_type}')
+        sw_lat, sw_long, ne_lat, ne_long = self.bounding_box
+        center_lat = (sw_lat + ne_lat) / 2
+        center_long = (sw_long + ne_long) / 2
+        buckets = {}
+        for index in range(self.density):
+            if index % 2:
+                lat = rng.gauss(center_lat, (ne_lat - sw_lat) / 12)
+                long = rng.gauss(center_long, (ne_long - sw_long) / 12)
+            else:
+                lat = rng.uniform(sw_lat, ne_lat)
+                long = rng.uniform(sw_long, ne_long)
+            if not (sw_lat <= lat <= ne_lat and sw_long <= long <= ne_long):
+                continue
+            street = rng.randrange(1, 9999)
+            business = {
+                '__type': 'LocalBusiness:http://schemas.microsoft.com/' +
+                          'search/local/ws/rest/v1',
+                'name': f'{business_type} {index}',
+                'point': {'type': 'Point', 'coordinates': [lat, long]},
+                'Address': {
+                    'addressLine': f'{street} Main St',
+                    'formattedAddress': f'{street} Main St, Springfield, ' +
+                                        f'XX {10000 + index % 90000}'
+                },
+                'PhoneNumber': (f'(555) {index % 1000:03d}-{street:04d}'
+                                if index % 3 else None),
+                'Website': (f'https://example.com/{business_type}/{index}'
+                            if index % 4 else None),
+                'entityType': ENTITY_TYPES.get(
+                    business_type, business_type.removesuffix('s'))
+            }
+            buckets.setdefault(self.bucket_for(lat, long), []).append(
+                business)
+
+        self.buckets[business_type] = buckets
+        return buckets
+
+    def search(self, business_types, map_view, max_results):
+        sw_lat, sw_long, ne_lat, ne_long = map_view
+        south, west = self.bucket_for(sw_lat, sw_long)
+        north, east = self.bucket_for(ne_lat, ne_long)
+        matches = []
+        for business_type in business_types:
+            buckets = self.businesses_for(business_type)
+            type_matches = []
+            for row in range(south, north + 1):
+                for column in range(west, east + 1):
+                    for business in buckets.get((row, column), ()):
+                        lat, long = business['point']['coordinates']
+                        if (sw_lat <= lat <= ne_lat and
+                                sw_long <= long <= ne_long):
+                            type_matches.append(business)
+            matches.append(type_matches)
+
+        # Like the real API, results of several types are interleaved
+        resources = []
+        for rank in range(max_results):
+            for type_matches in matches:
+                if rank < len(type_matches):
+                    resources.append(type_matches[rank])
+        return resources[:max_results]
+
+    async def local_search(self, request):
+        self.requests += 1
+        key = request.query.get('key')
+        self.key_requests[key] = self.key_requests.get(key, 0) + 1
+        if key in self.rejected_keys:
+            return web.json_response({'statusCode': 401}, status=401)
+        await sleep(max(0, self.random.gauss(self.latency,
+                                             self.latency_jitter)))
+
+        outcome = self.random.random()
+        if outcome < self.throttle_rate:
+            self.throttled += 1
+            return web.json_response({'statusCode': 429}, status=429)
+        if outcome < self.throttle_rate + self.error_rate:
+            self.errors += 1
+            return web.json_response({'statusCode': 500}, status=500)
+
+        query = request.query
+        try:
+            map_view = tuple(map(float, query['userMapView'].split(',')))
+            business_types = query['type'].split(',')
+            max_results = int(query.get('maxResults', 25))
+        except (KeyError, ValueError):
+            return web.json_response({'statusCode': 400}, status=400)
+
+        resources = self.search(business_types, map_view, max_results)
+        return web.json_response({
+            'statusCode': 200,
+            'resourceSets': [{
+                'estimatedTotal': len(resources),
+                'resources': resources
+            }]
+        })
+
+    async def nominatim(self, request):
+        sw_lat, sw_long, ne_lat, ne_long = self.bounding_box
+        lat_step = (ne_lat - sw_lat) / 3
+        long_step = (ne_long - sw_long) / 3
+        octagon = [
+            [sw_long + long_step, sw_lat], [ne_long - long_step, sw_lat],
+            [ne_long, sw_lat + lat_step], [ne_long, ne_lat - lat_step],
+            [ne_long - long_step, ne_lat], [sw_long + long_step, ne_lat],
+            [sw_long, ne_lat - lat_step], [sw_long, sw_lat + lat_step]
+        ]
+        octagon.append(octagon[0])
+        return web.json_response([{
+            'lat': str((sw_lat + ne_lat) / 2),
+            'lon': str((sw_long + ne_long) / 2),
+            'boundingbox': [str(sw_lat), str(ne_lat), str(sw_long),
+                            str(ne_long)],
+            'geojson': {'type': 'Polygon', 'coordinates': [octagon]}
+        }])
@@ -0,0 +1,127 @@
+"""
+This module generates many maps in one process from a manifest, for example
+for a nightly rebuild, instead of starting generateMapData.py once per map.
+
+All maps share one aiohttp session, the Bing Maps API request scheduler (and
+with it the QPS_LIMIT and TCP_LIMIT budget of generateMapData.py), the response
+cache and the geocoded places. Identical requests of maps generated at the same
+time, such as the same city requested with different titles or overlapping
+business types, are made once and shared by generateMapData.retrieve().
+At most BATCH_MAP_LIMIT maps are generated at once to bound memory use.
+
+Each map is generated by generateMapData.generate_map(), so its map file and
+entry in the Map table are written as soon as that map finishes, regardless of
+the rest of the batch. A map that fails does not stop the others.
+
+A manifest is a JSON array of objects with the following attributes, the same
+as the "CREATE" command of mapWorker.py:
+    "city": string representing the desired city to search
+    "state": string representing the state of the desired city to search
+    "title": string representing the user-created name for the map
+    "businessTypes": a comma separated string or a list of strings specifying
+        the desired Bing Maps API business type identifiers
+
+Global Variables:
+    BATCH_MAP_LIMIT: int for maximum number of maps generated at once
+
+Functions:
+    read_manifest: reads a manifest file
+    generate_maps: generates every map in a manifest
+
+When invoked directly, the following arguments generate every map in a
+manifest and print the results as JSON.
+
+Arguments:
+    manifest: file path of the manifest
+"""
+from asyncio import Semaphore, gather, run
+from generateMapData import generate_map, open_session, retrieve_api_key
+from json import dumps, load
+import sys
+
+
+BATCH_MAP_LIMIT = 8
+
+
+def read_manifest(path):
+    """
+    Reads a manifest file.
+
+    Returns:
+        A list of dictionaries with keys "city", "state", "title" and
+        "businessTypes", where businessTypes is a list of strings.
+
+    Raises:
+        ValueError: if the manifest is not an array of objects with every
+            attribute.
+    """
+    with open(path, 'r', encoding='utf-8') as manifest_file:
+        manifest = load(manifest_file)
+    if type(manifest) is not list:
+        raise ValueError("Manifest must be a JSON array")
+
+    entries = []
+    for index, entry in enumerate(manifest):
+        try:
+            business_types = entry['businessTypes']
+            if type(business_types) is str:
+                business_types = business_types.split(',')
+            entries.append({
+                'city': entry['city'],
+                'state': entry['state'],
+                'title': entry['title'],
+                'businessTypes': list(business_types)
+            })
+        except (KeyError, TypeError):
+            raise ValueError(f"Manifest entry {index} is missing attributes")
+    return entries
+
+
+async def generate_maps(manifest, session):
+    """
+    Generates every map in a manifest, at most BATCH_MAP_LIMIT at once.
+
+    Args:
+        manifest: a list of dictionaries returned by read_manifest().
+        session: aiohttp ClientSession returned by
+            generateMapData.open_session(), shared by every map.
+
+    Returns:
+        A list of dictionaries in the same order as manifest, each with key
+        "title" and either "mapId" for the new map or "error" describing why
+        it failed.
+    """
+    slots = Semaphore(BATCH_MAP_LIMIT)
+
+    async def generate(entry):
+        async with slots:
+            try:
+                map_id = await generate_map(entry['city'],
+                                            entry['state'],
+                                            entry['title'],
+                                            entry['businessTypes'],
+                                            session)
+            except Exception as err:
+                print("Failed map", entry['title'], repr(err))
+                return {'title': entry['title'], 'error': repr(err)}
+            print("Finished map", entry['title'], map_id)
+            return {'title': entry['title'], 'mapId': map_id}
+
+    return await gather(*(generate(entry) for entry in manifest))
+
+
+async def main():
+    retrieve_api_key()
+    manifest = read_manifest(sys.argv[1])
+    print("Read manifest with", len(manifest), "maps")
+
+    async with open_session() as session:
+        results = await generate_maps(manifest, session)
+    return results
+
+
+if __name__ == '__main__':
+    # Keep stdout for the results; progress messages go to stderr
+    output = sys.stdout
+    sys.stdout = sys.stderr
+    print(dumps(run(main()), ensure_ascii=False, indent=4), file=output)
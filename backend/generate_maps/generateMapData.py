@@ -2,6 +2,15 @@
 This module generates a JSON file containing location data for specified
 business types in a designated city (referred to as a map).
 
+Map objects are streamed to the map file by mapWriter.MapWriter as responses
+arrive, and the map file only appears once it has been completely written.
+When Nominatim returns a boundary polygon for the city, search grids are
+clipped to it with cityBoundary.Boundary: grids outside the city are skipped,
+partially covered grids are shrunk, and businesses outside it are discarded.
+Duplicate map objects from overlapping search grids and business types are
+detected by spatialDedup.DedupIndex; when a more complete duplicate arrives
+later, the written map object is replaced when the map file is finalized.
+
 Each map file is given a unique base-64 identifier and placed in the /maps
 directory. An entry for each map is also created in the MySQL Database table
 Map for indexing purposes.
@@ -15,16 +24,115 @@ Each map file contains an array of JSON objects with the following attributes:
     "p": string representing the phone number for the retrieved business
     "w": string representing the website for the retrieved business
 
+Search grids start from the coarse grid given by localSearch.search_grid() and
+are adaptively refined. Each grid is first requested for up to
+MAX_MERGED_TYPES business types at once. Whenever a response for several
+business types comes back saturated (MAX_RESULTS results), each business type
+is requested again alone. The response cannot tell which business types were
+dense, since its entity types ("Restaurant") are not request type IDs and
+never name a category. Whenever a response for a single business type comes
+back saturated, the grid is split into four quadrants with
+localSearch.split_grid() and each quadrant is requested again for that type,
+up to MAX_SPLIT_DEPTH times. Sparse grids are therefore requested once for all
+of their business types, while dense grids cost one extra request compared to
+requesting each business type separately.
+
+The generation plan of each map (city, state, business types, location and
+bounding box) is saved next to its map file as {id}.plan.json, so that the map
+can later be refreshed in place by refreshMap.py.
+
+Each completed request and its parsed businesses are journaled to
+{id}.journal.jsonl by mapJournal.MapJournal until the map file is finalized,
+so that a job that crashes or is killed partway through can be resumed by
+resumeMap.py without requesting the completed search grids again.
+
+Concurrent jobs of one process are queued by jobScheduler.JobScheduler, which
+runs at most MAX_RUNNING_JOBS of them at once and lets their Bing Maps API
+requests take turns in a shared budget, so that small maps are not starved by
+large ones.
+
+A summary of each map (counts by business type, locality and postal code,
+phone and website coverage, a density histogram and generation statistics) is
+written next to its map file as {id}.summary.json by mapSummary.py, so that
+charts and listings do not need to read the whole map file.
+
+Progress of each map is tracked by jobMetrics.JobMetrics: progress events are
+written to {id}.events.jsonl while the map is generated, and a summary of its
+counters, request latencies and stage timings to {id}.metrics.json once it
+finishes.
+
 Global Variables:
     LAT_PART: float for lat_size parameter in localSearch.search_grid()
     LONG_PART: float for long_partition parameter in localSearch.search_grid()
     SET_SIZE: boolean for set_size parameter in localSearch.search_grid()
+    MAX_SPLIT_DEPTH: int for maximum number of times a saturated search grid
+        is split into quadrants (0 disables adaptive refinement)
+    MAX_MERGED_TYPES: int for maximum number of business types combined into
+        one request (1 requests every business type separately)
+    BOUNDARY_FILTER: boolean toggling clipping of search grids and businesses
+        to the city boundary polygon
+    DEDUP_DISTANCE: float for distance (m) within which map objects with equal
+        normalized names or addresses are merged
     TCP_LIMIT: int for maximum concurrent TCP connections for Bing Maps API
-        requests (limit is 5)
+        requests per API key (limit is 5)
     MAX_RESULTS: int for maximum payload size for Bing Maps API responses
         (limit is 25)
-    BING_MAPS_KEY: string for Bing Maps API key located in
-        generate_maps/secrets.json with key "BING_MAPS_KEY"
+    MAPS_PATH: string for directory path of generated map files
+    MAP_FORMAT: string for map file format, "json" for a JSON array in
+        {id}.json or "jsonl" for JSON Lines in {id}.jsonl
+    WRITE_MAP_VARIANTS: boolean toggling the columnar {id}.cmap variant and
+        the precompressed .gz/.br siblings written by
+        mapFormats.write_map_variants()
+    WRITE_TILES: boolean toggling the tile pyramid {id}.tiles written by
+        mapTiles.build_tiles()
+    TILE_MIN_ZOOM: int for the lowest zoom level of the tile pyramid
+    TILE_POINT_ZOOM: int for the zoom level of point tiles in the tile pyramid
+    CACHE_PATH: string for file path of the Bing Maps API response cache
+    CACHE_TTL: int for maximum age (s) of cached Bing Maps API responses
+    CACHE_MAX_BYTES: int for byte budget of the Bing Maps API response cache
+    CACHE_PRECISION: int for decimal places that search grid coordinates are
+        rounded to when matching cached Bing Maps API responses
+    QPS_LIMIT: float for maximum average Bing Maps API requests per second
+        per API key
+    KEY_QUOTA: int for maximum Bing Maps API requests per API key and
+        process, or None for no quota
+    RETRY_LIMIT: int for retries of a failed Bing Maps API request
+    REQUEST_TIMEOUT: float for timeout (s) of a Bing Maps API request
+    HEDGE_PERCENTILE: float for latency percentile after which a Bing Maps
+        API request is hedged with a duplicate request
+    PROFILES_PATH: string for directory path of the cProfile profiles written
+        for each pipeline stage when jobMetrics.PROFILE_STAGES is enabled
+    PROMETHEUS_PATH: string for directory path the metrics of each finished
+        job are written to as {id}.prom in the Prometheus text format (for
+        example the node_exporter textfile collector directory), or None
+    MAX_RUNNING_JOBS: int for maximum number of map generation jobs
+        retrieving businesses at once, further jobs are queued
+
+Functions:
+    retrieve_api_keys: returns the Bing Maps API keys from secrets.json
+    retrieve_api_key: returns the first Bing Maps API key from secrets.json
+    retrieve_scheduler: returns the shared Bing Maps API request scheduler
+    retrieve_job_scheduler: returns the shared map generation job scheduler
+    open_session: creates the aiohttp session used for Bing Maps API requests
+    retrieve: requests a Bing Maps API url and collects its businesses,
+        sharing responses to identical requests already in flight
+    retrieve_grid: requests a search grid for a set of business types,
+        splitting the business types or the grid if saturated
+    retrieve_all: requests every search grid and business type for a map
+    retrieve_boundary: returns the city boundary for a geocoded place
+    write_plan: writes the generation plan of a map
+    read_plan: reads the generation plan of a map
+    finalize_map: writes the summary, variants and tile pyramid of a map
+        file
+    write_map: retrieves the businesses of a generation plan into a
+        journaled map file and finalizes it
+    open_metrics: starts writing the progress events of a map
+    write_metrics: writes the metrics summary of a finished map
+    finish_summary: writes the generation statistics of a map summary
+    generate_map: generates a map file and map index entry for a city
+
+When invoked directly, the following input values are read to generate a map.
+mapWorker.py calls generate_map() from a long-lived process instead.
 
 Input Values:
     city: string representing the desired city to search
@@ -33,128 +141,612 @@ Input Values:
     requested_types: a list or tuple of strings specifying the desired Bing
         Maps API business type identifiers
 
-This module uses the Bing Maps API and Nominatim API.
+This module uses the Bing Maps API and Nominatim API. Nominatim requests are
+made on the shared aiohttp session and cached by geocoder.geocode().
 """
-from asyncio import ensure_future, gather, run
+from asyncio import ensure_future, gather, run, shield, to_thread
 from aiohttp.client import ClientSession, TCPConnector
-from json import dump, loads
-from localSearch import construct_request, parse_locations, search_grid
+from cityBoundary import Boundary, parse_geojson
+from geocoder import geocode
+from jobMetrics import JobMetrics
+from jobScheduler import JobScheduler
+from json import dump, load, loads
+from localSearch import (construct_request, normalize_types, parse_response,
+                         search_grid, split_grid)
+from mapFormats import iter_map_objects, write_map_variants
 from mapIndexHandler import create_index
-from os.path import dirname
-from requests import get
+from mapJournal import MapJournal
+from mapSummary import write_generation, write_summary
+from mapTiles import build_tiles
+from mapWriter import MapWriter
+from os import makedirs
+from os.path import dirname, join
+from requestScheduler import RequestFailedError, RequestScheduler
+from responseCache import cache_get, cache_key, cache_put, open_cache
+from spatialDedup import DedupIndex
+from time import perf_counter, time
 from verifyMapInputs import verify_map_inputs
 
 
 # Global Variables
-LAT_PART = 5
-LONG_PART = 8
+LAT_PART = 2
+LONG_PART = 3
 SET_SIZE = False
+MAX_SPLIT_DEPTH = 4
+MAX_MERGED_TYPES = 5
+BOUNDARY_FILTER = True
+DEDUP_DISTANCE = 25
 TCP_LIMIT = 4
 MAX_RESULTS = 25
 FILE_PATH = dirname(__file__)
+MAPS_PATH = join(FILE_PATH, 'maps')
+MAP_FORMAT = 'json'
+WRITE_MAP_VARIANTS = True
+WRITE_TILES = True
+TILE_MIN_ZOOM = 6
+TILE_POINT_ZOOM = 13
+CACHE_PATH = join(FILE_PATH, 'responseCache.db')
+CACHE_TTL = 7 * 24 * 60 * 60
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_PRECISION = 4
+QPS_LIMIT = 10
+KEY_QUOTA = None
+RETRY_LIMIT = 4
+REQUEST_TIMEOUT = 10
+HEDGE_PERCENTILE = 0.95
+PROFILES_PATH = join(FILE_PATH, 'profiles')
+PROMETHEUS_PATH = None
+MAX_RUNNING_JOBS = 8
 
-# Retrieve Bing Maps API key
-with open(f'{FILE_PATH}\secrets.json', 'r') as secrets:
-    BING_MAPS_KEY = loads(secrets.read())['BING_MAPS_KEY']
-print("Retrieved API key")
-
-# Retrieve input values
-city = input()
-state = input()
-title = input()
-requested_types = tuple(input().split(','))
-print("Retrieved input values")
-
-# Send Nominatim API request
-nominatim_request_url = ("https://nominatim.openstreetmap.org/search.php?" +
-    "format=json&city=" + city + "&state=" + state)
-nominatim_response = get(nominatim_request_url).json()
-print("Received Nominatim response")
-
-# Verify map input values
-verify_map_inputs(city,
-                  state,
-                  title,
-                  requested_types,
-                  MAX_RESULTS,
-                  BING_MAPS_KEY,
-                  TCP_LIMIT,
-                  nominatim_response)
-
-# Retrieve city location and bounding box
-location = [
-    float(nominatim_response[0]['lat']),
-    float(nominatim_response[0]['lon'])
-]
-bounding_box = nominatim_response[0]['boundingbox']
-bounding_box[2], bounding_box[1] = bounding_box[1], bounding_box[2]
-bounding_box = tuple(map(float, bounding_box))
-print("Retrieved location", location)
-print("Retrieved bounding box", bounding_box)
-
-# Create asynchronous Bing Maps API request functions
 desired_attributes = ('name', 'point.coordinates', 'Address.formattedAddress',
                       'entityType', 'PhoneNumber', 'Website')
 
+# Loaded once per process and shared between map generation jobs
+bing_maps_keys = None
+response_cache = None
+request_scheduler = None
+job_scheduler = None
+pending_responses = {}
+
+
+class MapJob:
+    """
+    Holds the state of a single map generation job.
+
+    Attributes:
+        requested_types: a tuple of strings specifying the Bing Maps API
+            business type identifiers to search for, without identifiers
+            covered by a category also searched for
+        bounding_box: a tuple of 4 floats specifying the search region, in the
+            same order as localSearch.search_grid()
+        boundary: cityBoundary.Boundary of the city, or None to search the
+            whole bounding box
+        writer: mapWriter.MapWriter that retrieved map objects are written to,
+            or None to only collect them in dedup
+        dedup: spatialDedup.DedupIndex of map objects retrieved so far
+        cache_ttl: int for maximum age (s) of cached responses used by the job
+        failed_requests: a list of (grid, requested_type, reason) tuples for
+            requests that failed every retry
+        metrics: jobMetrics.JobMetrics of the job
+        journal: mapJournal.MapJournal that completed requests are recorded
+            to and replayed from, or None
+    """
+
+    def __init__(self, requested_types, bounding_box, writer, boundary=None,
+                 cache_ttl=CACHE_TTL, metrics=None, journal=None):
+        self.requested_types = normalize_types(requested_types)
+        self.bounding_box = tuple(bounding_box)
+        self.boundary = boundary
+        self.writer = writer
+        self.cache_ttl = cache_ttl
+        self.dedup = DedupIndex(
+            DEDUP_DISTANCE,
+            max(abs(self.bounding_box[0]), abs(self.bounding_box[2]))
+        )
+        self.failed_requests = []
+        self.metrics = metrics if metrics is not None else JobMetrics()
+        self.journal = journal
+
+
+def retrieve_api_keys():
+    """
+    Returns the list of Bing Maps API keys located in
+    generate_maps/secrets.json with key "BING_MAPS_KEYS", or the single key
+    with key "BING_MAPS_KEY" if there is no such list. The file is only read
+    once per process.
+    """
+    global bing_maps_keys
+    if bing_maps_keys is None:
+        with open(join(FILE_PATH, 'secrets.json'), 'r') as secrets:
+            secrets = loads(secrets.read())
+        bing_maps_keys = secrets.get('BING_MAPS_KEYS') or [
+            secrets['BING_MAPS_KEY']]
+    return bing_maps_keys
+
+
+def retrieve_api_key():
+    """
+    Returns the first Bing Maps API key from retrieve_api_keys(). The request
+    scheduler replaces it with the key each request is sent with.
+    """
+    return retrieve_api_keys()[0]
+
+
+def retrieve_response_cache():
+    """
+    Returns the Bing Maps API response cache, opening it on first use.
+    """
+    global response_cache
+    if response_cache is None:
+        response_cache = open_cache(CACHE_PATH)
+    return response_cache
+
+
+def retrieve_scheduler():
+    """
+    Returns the Bing Maps API request scheduler, creating it on first use. The
+    scheduler is shared so that concurrent jobs share one rate limit per API
+    key.
+    """
+    global request_scheduler
+    if request_scheduler is None:
+        request_scheduler = RequestScheduler(QPS_LIMIT,
+                                             TCP_LIMIT,
+                                             keys=retrieve_api_keys(),
+                                             key_quota=KEY_QUOTA,
+                                             max_retries=RETRY_LIMIT,
+                                             timeout=REQUEST_TIMEOUT,
+                                             hedge_percentile=HEDGE_PERCENTILE)
+    return request_scheduler
+
 
-async def retrieve(url, session):
-    async with session.get(url) as response:
-        results = await response.json()
-        for name, coords, add, bus_type, phone, website in parse_locations(
-            results, desired_attributes
-        ):
-            map_object = {
-                'n': name,
-                'c': coords,
-                'a': add,
-                't': bus_type,
-                'p': phone,
-                'w': website
-            }
-            if add not in covered_addresses:
-                map_objects.append(map_object)
-                covered_addresses.add(add)
-
-
-async def retrieve_all():
-    connector = TCPConnector(limit=TCP_LIMIT)
-    async with ClientSession(connector=connector) as session:
-        tasks = []
-        for grid in search_grid(bounding_box, LAT_PART, LONG_PART, SET_SIZE):
-            for requested_type in requested_types:
-                url = construct_request(
-                    types=requested_type,
-                    maxResults=MAX_RESULTS,
-                    userMapView=grid,
-                    key=BING_MAPS_KEY
-                )
-                task = ensure_future(retrieve(url, session))
-                tasks.append(task)
-
-        await gather(*tasks, return_exceptions=True)
-
-
-# Create map id and entry in map index
-map_file_name = create_index(
-    title,
-    location,
-    list(bounding_box)
-)
-print("Created map index entry")
-
-# Generate and write map data
-map_objects = []
-covered_addresses = set()
-with open(
-    f'{FILE_PATH}\maps\{map_file_name}.json', 'w', encoding='utf-8'
-) as map_file:
-    print("Created map file")
-    run(retrieve_all())
-    print("Completed async requests")
-    dump(
-        map_objects,
-        map_file,
-        ensure_ascii=False
+def retrieve_job_scheduler():
+    """
+    Returns the scheduler of map generation jobs, creating it on first use.
+    Jobs share TCP_LIMIT concurrent requests per API key between them.
+    """
+    global job_scheduler
+    if job_scheduler is None:
+        job_scheduler = JobScheduler(MAX_RUNNING_JOBS,
+                                     TCP_LIMIT * len(retrieve_api_keys()))
+    return job_scheduler
+
+
+def open_session():
+    """
+    Creates the aiohttp session used for Bing Maps API requests, limited to
+    TCP_LIMIT concurrent connections per API key. Must be closed by the
+    caller.
+    """
+    return ClientSession(connector=TCPConnector(
+        limit=TCP_LIMIT * len(retrieve_api_keys())))
+
+
+async def fetch_response(url, key, session, on_retry, metrics):
+    # Requests of concurrent jobs take turns in the shared request budget
+    async with retrieve_job_scheduler().requests.turn(metrics):
+        results = await retrieve_scheduler().fetch(session, url, on_retry)
+    cache_put(retrieve_response_cache(), key, results, CACHE_MAX_BYTES)
+    return results
+
+
+async def retrieve(url, session, job):
+    metrics = job.metrics
+    key = cache_key(url, CACHE_PRECISION)
+    start = perf_counter()
+
+    # Requests completed before a resumed job was interrupted are replayed
+    businesses = job.journal.get(key) if job.journal is not None else None
+    replayed = businesses is not None
+    cached = False
+    if replayed:
+        metrics.count('journal_replayed')
+    else:
+        # Cache hits skip the network and the TCP connection limit entirely
+        cache = retrieve_response_cache()
+        results = cache_get(cache, key, job.cache_ttl)
+        cached = results is not None
+        if cached:
+            metrics.count('cache_hits')
+        else:
+            def on_retry(reason):
+                metrics.count('retries')
+                metrics.event('retry', reason=reason)
+
+            # Identical requests of concurrent jobs share one response
+            if key in pending_responses:
+                metrics.count('requests_shared')
+            else:
+                pending_responses[key] = ensure_future(
+                    fetch_response(url, key, session, on_retry, metrics))
+            task = pending_responses[key]
+            try:
+                results = await shield(task)
+            finally:
+                if task.done() and pending_responses.get(key) is task:
+                    del pending_responses[key]
+            metrics.observe_latency(perf_counter() - start)
+
+        businesses = list(parse_response(results, desired_attributes))
+        if job.journal is not None:
+            job.journal.record(key, businesses)
+
+    result_count = 0
+    statuses = {'new': 0, 'duplicate': 0, 'replaced': 0}
+    for name, coords, add, bus_type, phone, website in businesses:
+        map_object = {
+            'n': name,
+            'c': coords,
+            'a': add,
+            't': bus_type,
+            'p': phone,
+            'w': website
+        }
+        result_count += 1
+        if (job.boundary is not None and coords and
+                not job.boundary.contains(*coords)):
+            continue
+        status, seq, merged_object = job.dedup.add(map_object)
+        statuses[status] += 1
+        if job.writer is None:
+            continue
+        if status == 'new':
+            job.writer.write(map_object)
+        elif status == 'replaced':
+            job.writer.replace(seq, merged_object)
+    if job.writer is not None:
+        job.writer.flush()
+        metrics.bytes_written = job.writer.bytes_written
+
+    metrics.count('cells_done')
+    metrics.count('results', result_count)
+    metrics.count('dedup_new', statuses['new'])
+    metrics.count('dedup_duplicates', statuses['duplicate'])
+    metrics.count('dedup_replaced', statuses['replaced'])
+    metrics.event('request',
+                  cached=cached,
+                  replayed=replayed,
+                  seconds=perf_counter() - start,
+                  results=result_count,
+                  new=statuses['new'],
+                  duplicates=statuses['duplicate'],
+                  replaced=statuses['replaced'],
+                  bytesWritten=metrics.bytes_written,
+                  cellsDone=metrics.counters['cells_done'],
+                  cellsPlanned=metrics.counters['cells_planned'])
+    return result_count
+
+
+async def retrieve_grid(grid, requested_types, session, job, depth=0):
+    if job.boundary is not None:
+        clipped_grid = job.boundary.clip(grid)
+        if clipped_grid is None:
+            job.metrics.count('cells_skipped')
+            job.metrics.event('skipped', types=list(requested_types),
+                              grid=list(grid))
+            return
+        grid = clipped_grid
+
+    url = construct_request(
+        types=requested_types,
+        maxResults=MAX_RESULTS,
+        userMapView=grid,
+        key=retrieve_api_key()
     )
+    try:
+        result_count = await retrieve(url, session, job)
+    except RequestFailedError as err:
+        for requested_type in requested_types:
+            job.failed_requests.append((grid, requested_type, err.reason))
+        job.metrics.count('cells_failed')
+        job.metrics.event('failed', types=list(requested_types),
+                          grid=list(grid), reason=err.reason)
+        return
+
+    if result_count < MAX_RESULTS:
+        return
+
+    # Saturated responses may have dropped businesses, so request each
+    # business type alone before refining the grid
+    if len(requested_types) > 1:
+        job.metrics.count('types_split')
+        job.metrics.count('cells_planned', len(requested_types))
+        job.metrics.event('split', types=list(requested_types),
+                          grid=list(grid), depth=depth)
+        await gather(
+            *(retrieve_grid(grid, (requested_type,), session, job, depth)
+              for requested_type in requested_types),
+            return_exceptions=True
+        )
+    elif depth < MAX_SPLIT_DEPTH:
+        job.metrics.count('cells_split')
+        job.metrics.count('cells_planned', 4)
+        job.metrics.event('split', types=list(requested_types),
+                          grid=list(grid), depth=depth)
+        await gather(
+            *(retrieve_grid(quadrant, requested_types, session, job,
+                            depth + 1)
+              for quadrant in split_grid(grid)),
+            return_exceptions=True
+        )
+
+
+async def retrieve_all(job, session, grids=None):
+    if grids is None:
+        grids = search_grid(job.bounding_box, LAT_PART, LONG_PART, SET_SIZE)
+
+    type_groups = [
+        job.requested_types[index:index + MAX_MERGED_TYPES]
+        for index in range(0, len(job.requested_types), MAX_MERGED_TYPES)
+    ]
+    tasks = []
+    for grid in grids:
+        for requested_types in type_groups:
+            task = ensure_future(
+                retrieve_grid(grid, requested_types, session, job))
+            tasks.append(task)
+    job.metrics.count('cells_planned', len(tasks))
+    job.metrics.event('planned', cells=len(tasks))
+
+    await gather(*tasks, return_exceptions=True)
+
+
+def retrieve_boundary(place):
+    """
+    Returns the cityBoundary.Boundary for a place returned by
+    geocoder.geocode(), or None if BOUNDARY_FILTER is disabled or the place
+    has no boundary polygon.
+    """
+    if not BOUNDARY_FILTER:
+        return None
+    polygons = parse_geojson(place['geojson'])
+    return Boundary(polygons) if polygons else None
+
+
+def write_plan(map_id, plan):
+    """
+    Writes the generation plan of a map to {id}.plan.json.
+
+    Args:
+        map_id: string representing the map id.
+        plan: dictionary with keys "city", "state", "types", "location",
+            "boundingBox" and "format".
+    """
+    plan_path = join(MAPS_PATH, f'{map_id}.plan.json')
+    with open(plan_path, 'w', encoding='utf-8') as plan_file:
+        dump(plan, plan_file, ensure_ascii=False)
+
+
+def read_plan(map_id):
+    """
+    Reads the generation plan of a map written by write_plan().
+
+    Raises:
+        ValueError: if the map has no generation plan.
+    """
+    try:
+        with open(join(MAPS_PATH, f'{map_id}.plan.json'), 'r',
+                  encoding='utf-8') as plan_file:
+            return load(plan_file)
+    except FileNotFoundError:
+        raise ValueError(f"Map {map_id} has no generation plan")
+
+
+async def finalize_map(map_id, map_path, bounding_box):
+    """
+    Writes the summary of a finalized map file, and its columnar and
+    precompressed variants and tile pyramid as enabled by WRITE_MAP_VARIANTS
+    and WRITE_TILES. The generation statistics of the summary are written by
+    finish_summary() once the job has finished.
+    """
+    await to_thread(write_summary,
+                    map_path,
+                    join(MAPS_PATH, f'{map_id}.summary.json'),
+                    bounding_box)
+    print("Created map summary")
+
+    if WRITE_MAP_VARIANTS:
+        await to_thread(write_map_variants, map_path)
+        print("Created columnar and compressed map files")
+
+    if WRITE_TILES:
+        await to_thread(build_tiles,
+                        iter_map_objects(map_path),
+                        join(MAPS_PATH, f'{map_id}.tiles'),
+                        bounding_box,
+                        TILE_MIN_ZOOM,
+                        TILE_POINT_ZOOM)
+        print("Created map tiles")
+
+
+def open_metrics(map_id, metrics):
+    """
+    Starts writing the progress events of a map to {id}.events.jsonl, and its
+    stage profiles to PROFILES_PATH if profiling is enabled.
+    """
+    metrics.map_id = map_id
+    metrics.open_events(join(MAPS_PATH, f'{map_id}.events.jsonl'),
+                        join(PROFILES_PATH, map_id))
+
+
+def write_metrics(map_id, metrics):
+    """
+    Stops writing the progress events of a map and writes its metrics summary
+    to {id}.metrics.json, and to {id}.prom in PROMETHEUS_PATH if set. Each
+    map has its own Prometheus file, so that the metrics of concurrent jobs
+    are all kept until scraped.
+
+    Returns:
+        The metrics summary dictionary.
+    """
+    metrics.close()
+    summary = metrics.write_summary(
+        join(MAPS_PATH, f'{map_id}.metrics.json'))
+    if PROMETHEUS_PATH:
+        makedirs(PROMETHEUS_PATH, exist_ok=True)
+        metrics.write_prometheus(join(PROMETHEUS_PATH, f'{map_id}.prom'))
+    print("Metrics", metrics.counters)
+    return summary
+
+
+async def finish_summary(map_id, generation):
+    """
+    Writes the metrics summary returned by write_metrics() as the generation
+    statistics of the map summary written by finalize_map().
+    """
+    await to_thread(write_generation,
+                    join(MAPS_PATH, f'{map_id}.summary.json'),
+                    generation)
+
+
+async def write_map(map_id, plan, boundary, session, metrics):
+    """
+    Retrieves the businesses of a generation plan into the map file of a map
+    and finalizes it. Each completed request is journaled to
+    {id}.journal.jsonl, and requests already in the journal are replayed
+    instead of being requested again. The journal is removed once the map
+    file is finalized, and the metrics of the job are written once it
+    finishes.
+
+    Args:
+        map_id: string representing the map id.
+        plan: dictionary written by write_plan().
+        boundary: cityBoundary.Boundary of the city, or None.
+        session: aiohttp ClientSession returned by open_session().
+        metrics: jobMetrics.JobMetrics of the job, with events opened by
+            open_metrics().
+
+    Returns:
+        The closed mapWriter.MapWriter of the map file.
+    """
+    map_format = plan.get('format', MAP_FORMAT)
+    journal = MapJournal(join(MAPS_PATH, f'{map_id}.journal.jsonl'))
+    if len(journal):
+        print("Replaying", len(journal), "journaled requests")
+
+    try:
+        # Generate and stream map data to the map file
+        with metrics.stage('retrieve'), MapWriter(
+            join(MAPS_PATH, f'{map_id}.{map_format}'), map_format
+        ) as writer:
+            print("Created map file")
+            job = MapJob(plan['types'], plan['boundingBox'], writer, boundary,
+                         metrics=metrics, journal=journal)
+            await retrieve_all(job, session)
+            print("Completed async requests")
+            for grid, requested_type, reason in job.failed_requests:
+                print("Failed request", requested_type, grid, reason)
+
+        with metrics.stage('finalize'):
+            await finalize_map(map_id, writer.path, plan['boundingBox'])
+    finally:
+        journal.close()
+        generation = write_metrics(map_id, metrics)
+
+    journal.remove()
+    await finish_summary(map_id, generation)
+    print("Finished map generation", writer.count, "map objects")
+    return writer
+
+
+async def generate_map(city, state, title, requested_types, session,
+                       wait=True):
+    """
+    Generates a map file and map index entry for the given city.
+
+    Args:
+        city: string representing the desired city to search
+        state: string representing the state of the desired city to search
+        title: string representing the user-created name for the map
+        requested_types: a list or tuple of strings specifying the desired
+            Bing Maps API business type identifiers
+        session: aiohttp ClientSession returned by open_session()
+        wait: boolean for whether to return once the map file is finalized,
+            or as soon as the job is queued (its progress can then be
+            followed with retrieve_job_scheduler().status())
+
+    Returns:
+        A string representing the base-64 unique identifier for the new map.
+
+    Raises:
+        ValueError: if any input value is invalid.
+    """
+    requested_types = tuple(requested_types)
+    metrics = JobMetrics()
+
+    # Geocode city with the Nominatim API
+    with metrics.stage('geocode'):
+        place = await geocode(city, state, session,
+                              retrieve_response_cache(), CACHE_MAX_BYTES)
+    print("Retrieved Nominatim place")
+
+    # Verify map input values
+    verify_map_inputs(city,
+                      state,
+                      title,
+                      requested_types,
+                      MAX_RESULTS,
+                      retrieve_api_key(),
+                      TCP_LIMIT,
+                      place)
+
+    # Retrieve city location and bounding box
+    location = place['location']
+    bounding_box = tuple(place['bounding_box'])
+    print("Retrieved location", location)
+    print("Retrieved bounding box", bounding_box)
+
+    # Retrieve city boundary polygon
+    boundary = retrieve_boundary(place)
+    if boundary is not None:
+        print("Retrieved boundary with", len(boundary.polygons), "polygons")
+
+    # Create map id and entry in map index
+    with metrics.stage('index'):
+        map_file_name = await to_thread(
+            create_index,
+            title,
+            location,
+            list(bounding_box)
+        )
+    print("Created map index entry")
+
+    plan = {
+        'city': city,
+        'state': state,
+        'types': list(requested_types),
+        'location': location,
+        'boundingBox': list(bounding_box),
+        'format': MAP_FORMAT,
+        'generated': time()
+    }
+    write_plan(map_file_name, plan)
+    open_metrics(map_file_name, metrics)
+
+    # Queue the job behind the other running jobs
+    scheduler = retrieve_job_scheduler()
+    job = write_map(map_file_name, plan, boundary, session, metrics)
+    if wait:
+        await scheduler.run(map_file_name, metrics, job)
+    else:
+        scheduler.submit(map_file_name, metrics, job)
+    return map_file_name
+
+
+async def main():
+    retrieve_api_key()
+    print("Retrieved API key")
+
+    # Retrieve input values
+    city = input()
+    state = input()
+    title = input()
+    requested_types = tuple(input().split(','))
+    print("Retrieved input values")
+
+    async with open_session() as session:
+        await generate_map(city, state, title, requested_types, session)
+
 
-print("Finished map generation")
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,145 @@
+"""
+This module contains methods to assist with geocoding cities with the Nominatim
+API on the shared aiohttp session.
+
+Geocoded places are stored in the response cache (see responseCache.py) keyed
+on the normalized city and state, so cities that were already geocoded are
+not requested again until their cache entry expires. Requests to Nominatim are
+limited to one per second as required by its usage policy, and concurrent
+lookups of the same place share a single request.
+
+Each place is a dictionary with the following attributes:
+    "location": a list of 2 floats specifying the coordinate location of the
+        city
+    "bounding_box": a list of 4 floats specifying the bounding box of the
+        city, in the same order as localSearch.search_grid()
+    "geojson": dictionary created from the GeoJSON boundary of the city, or
+        None if Nominatim did not return one
+
+Global Variables:
+    NOMINATIM_URL: string for the Nominatim API search url
+    NOMINATIM_USER_AGENT: string identifying this application to Nominatim
+    NOMINATIM_QPS: float for the maximum Nominatim requests per second
+    GEOCODE_TTL: int for maximum age (s) of cached places
+    POLYGON_THRESHOLD: float for the tolerance (degrees) Nominatim simplifies
+        city boundary polygons with
+
+Functions:
+    place_key: normalizes a city and state into a cache key
+    geocode: returns the place for a city, from the cache if possible
+    geocode_all: geocodes many cities concurrently
+"""
+from asyncio import ensure_future, gather, shield
+from requestScheduler import TokenBucket
+from responseCache import cache_get, cache_put
+from urllib.parse import urlencode
+
+
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search.php"
+NOMINATIM_USER_AGENT = "business-finder"
+NOMINATIM_QPS = 1
+GEOCODE_TTL = 30 * 24 * 60 * 60
+POLYGON_THRESHOLD = 0.0005
+
+nominatim_bucket = None
+pending_places = {}
+
+
+def place_key(city, state):
+    """
+    Normalizes a city and state into a cache key, ignoring case and repeated
+    whitespace.
+    """
+    return 'nominatim:' + '|'.join(
+        ' '.join(value.lower().split()) for value in (city, state))
+
+
+def parse_place(nominatim_response):
+    if not nominatim_response:
+        return None
+    result = nominatim_response[0]
+    bounding_box = list(map(float, result['boundingbox']))
+    bounding_box[2], bounding_box[1] = bounding_box[1], bounding_box[2]
+    return {
+        'location': [float(result['lat']), float(result['lon'])],
+        'bounding_box': bounding_box,
+        'geojson': result.get('geojson')
+    }
+
+
+async def request_place(city, state, session):
+    global nominatim_bucket
+    if nominatim_bucket is None:
+        nominatim_bucket = TokenBucket(NOMINATIM_QPS, 1)
+    await nominatim_bucket.acquire()
+
+    params = {
+        'format': 'json',
+        'city': city,
+        'state': state,
+        'limit': 1,
+        'polygon_geojson': 1,
+        'polygon_threshold': POLYGON_THRESHOLD
+    }
+    async with session.get(
+        f"{NOMINATIM_URL}?{urlencode(params)}",
+        headers={'User-Agent': NOMINATIM_USER_AGENT}
+    ) as response:
+        response.raise_for_status()
+        return parse_place(await response.json())
+
+
+async def geocode(city, state, session, cache, cache_max_bytes):
+    """
+    Returns the place for a city, requesting it from Nominatim only if it is
+    not cached.
+
+    Args:
+        city: string representing the city to geocode.
+        state: string representing the state of the city.
+        session: aiohttp ClientSession used for the request.
+        cache: sqlite3.Connection returned by responseCache.open_cache().
+        cache_max_bytes: integer representing the byte budget of the cache.
+
+    Returns:
+        A place dictionary, or None if Nominatim found no such city.
+
+    Raises:
+        aiohttp.ClientError: if the Nominatim request fails.
+    """
+    key = place_key(city, state)
+    cached = cache_get(cache, key, GEOCODE_TTL)
+    if cached is not None:
+        return cached['place']
+
+    # Concurrent lookups of the same place share one request
+    if key not in pending_places:
+        pending_places[key] = ensure_future(
+            request_place(city, state, session))
+    task = pending_places[key]
+    try:
+        place = await shield(task)
+    finally:
+        if task.done() and pending_places.get(key) is task:
+            del pending_places[key]
+
+    if place is not None:
+        cache_put(cache, key, {'place': place}, cache_max_bytes)
+    return place
+
+
+async def geocode_all(places, session, cache, cache_max_bytes):
+    """
+    Geocodes many cities concurrently, respecting the Nominatim rate limit.
+
+    Args:
+        places: a list or tuple of (city, state) tuples.
+        session, cache, cache_max_bytes: as in geocode().
+
+    Returns:
+        A list of place dictionaries (or None), in the same order as places.
+    """
+    return await gather(*(
+        geocode(city, state, session, cache, cache_max_bytes)
+        for city, state in places
+    ))
@@ -0,0 +1,223 @@
+"""
+This module collects progress events, counters, latency histograms and stage
+timings for map generation jobs, so that generation can be followed while it
+runs and tuned afterwards (for example LAT_PART, LONG_PART and TCP_LIMIT in
+generateMapData.py).
+
+Progress events are written as JSON Lines, one JSON object per event, each
+with the following attributes:
+    "time": float for the Unix time of the event
+    "event": string naming the event
+    "map": string for the map id of the job, if known
+and additional attributes depending on the event:
+    "stage": "stage", "seconds" when a pipeline stage finishes
+    "planned": "cells" when search grid requests are planned
+    "request": "cached", "replayed", "seconds", "results", "new",
+        "duplicates", "replaced", "bytesWritten", "cellsDone" and
+        "cellsPlanned" when a search grid request finishes
+    "split": "types", "grid", "depth" when the business types or search grid
+        of a saturated request are split
+    "skipped": "types", "grid" when a search grid is outside the boundary
+    "retry": "reason" when a request is retried
+    "failed": "types", "grid", "reason" when a request fails every retry
+
+Counters and histograms can be exported in the Prometheus text exposition
+format, and a summary of the job is written when it finishes.
+
+Global Variables:
+    METRICS_PREFIX: string prefixed to every exported Prometheus metric name
+    LATENCY_BUCKETS: tuple of floats for the upper bounds (s) of the request
+        latency histogram buckets
+    COUNTERS: tuple of strings naming the counters of each job
+    PROFILE_STAGES: boolean toggling cProfile profiling of pipeline stages
+
+Classes:
+    JobMetrics: progress events and metrics of a single job
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from cProfile import Profile
+from json import dump, dumps
+from os import makedirs, replace
+from os.path import dirname
+from time import perf_counter, time
+
+
+METRICS_PREFIX = 'business_finder_'
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNTERS = ('cells_planned', 'cells_done', 'cells_split', 'types_split',
+            'cells_skipped', 'cells_failed', 'cache_hits', 'requests_shared',
+            'journal_replayed', 'retries', 'results', 'dedup_new',
+            'dedup_duplicates', 'dedup_replaced')
+PROFILE_STAGES = False
+
+
+class JobMetrics:
+    """
+    Progress events and metrics of a single map generation job.
+
+    Attributes:
+        map_id: string for the map id of the job, or None until it is known
+        counters: dictionary mapping each name in COUNTERS to an int
+        latency_buckets: list of int counts of request latencies in each of
+            LATENCY_BUCKETS, plus one for latencies above every bucket
+        latency_sum: float for the sum of request latencies (s)
+        latency_count: int count of request latencies
+        stages: dictionary mapping stage names to their duration (s)
+        bytes_written: int count of bytes written to the map file
+        started: float for the Unix time the job started
+    """
+
+    def __init__(self, map_id=None):
+        self.map_id = map_id
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0
+        self.latency_count = 0
+        self.stages = {}
+        self.bytes_written = 0
+        self.started = time()
+        self.events = None
+        self.profile_path = None
+
+    def open_events(self, events_path, profile_path=None):
+        """
+        Starts writing progress events to a JSON Lines file, and profiles of
+        stages to profile_path with the stage name appended if PROFILE_STAGES
+        is enabled.
+        """
+        self.events = open(events_path, 'w', encoding='utf-8')
+        self.profile_path = profile_path
+
+    def close(self):
+        if self.events is not None:
+            self.events.close()
+            self.events = None
+
+    def event(self, name, **attributes):
+        """
+        Writes a progress event if an events file is open.
+        """
+        if self.events is None:
+            return
+        record = {'time': time(), 'event': name, 'map': self.map_id}
+        record.update(attributes)
+        self.events.write(dumps(record, ensure_ascii=False) + '\n')
+        self.events.flush()
+
+    def count(self, name, value=1):
+        self.counters[name] += value
+
+    def observe_latency(self, seconds):
+        self.latency_buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.latency_sum += seconds
+        self.latency_count += 1
+
+    def progress(self):
+        """
+        Returns the fraction (0-1) of planned search grid requests that have
+        finished, failed or been skipped.
+        """
+        planned = self.counters['cells_planned']
+        if not planned:
+            return 0
+        finished = (self.counters['cells_done'] +
+                    self.counters['cells_failed'] +
+                    self.counters['cells_skipped'])
+        return min(finished / planned, 1)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager that times a pipeline stage, and profiles it with
+        cProfile if PROFILE_STAGES is enabled and a profile path was given to
+        open_events(). Profiles of stages that await include every coroutine
+        running on the event loop meanwhile.
+        """
+        profile = None
+        if PROFILE_STAGES and self.profile_path:
+            profile = Profile()
+            profile.enable()
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            seconds = perf_counter() - start
+            if profile is not None:
+                profile.disable()
+                makedirs(dirname(self.profile_path), exist_ok=True)
+                profile.dump_stats(f'{self.profile_path}.{name}')
+            self.stages[name] = self.stages.get(name, 0) + seconds
+            self.event('stage', stage=name, seconds=seconds)
+
+    def summary(self):
+        """
+        Returns a JSON serializable dictionary summarizing the job.
+        """
+        return {
+            'map': self.map_id,
+            'started': self.started,
+            'seconds': time() - self.started,
+            'counters': dict(self.counters),
+            'bytesWritten': self.bytes_written,
+            'stages': dict(self.stages),
+            'latency': {
+                'buckets': dict(zip(
+                    [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf'],
+                    self.latency_buckets)),
+                'sum': self.latency_sum,
+                'count': self.latency_count
+            }
+        }
+
+    def write_summary(self, path):
+        """
+        Writes the summary of the job to path and returns it.
+        """
+        summary = self.summary()
+        with open(path, 'w', encoding='utf-8') as summary_file:
+            dump(summary, summary_file, ensure_ascii=False)
+        return summary
+
+    def prometheus_text(self):
+        """
+        Returns the counters, request latency histogram and stage durations
+        of the job in the Prometheus text exposition format.
+        """
+        labels = f'map="{self.map_id}"'
+        lines = []
+        for name, value in self.counters.items():
+            metric = f'{METRICS_PREFIX}{name}_total'
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric}{{{labels}}} {value}')
+
+        metric = f'{METRICS_PREFIX}bytes_written_total'
+        lines.append(f'# TYPE {metric} counter')
+        lines.append(f'{metric}{{{labels}}} {self.bytes_written}')
+
+        metric = f'{METRICS_PREFIX}request_latency_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS + ('+Inf',),
+                                self.latency_buckets):
+            cumulative += count
+            lines.append(
+                f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_sum{{{labels}}} {self.latency_sum}')
+        lines.append(f'{metric}_count{{{labels}}} {self.latency_count}')
+
+        metric = f'{METRICS_PREFIX}stage_seconds'
+        lines.append(f'# TYPE {metric} gauge')
+        for name, seconds in self.stages.items():
+            lines.append(
+                f'{metric}{{{labels},stage="{name}"}} {seconds}')
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        """
+        Atomically writes prometheus_text() to a file, for example for the
+        node_exporter textfile collector.
+        """
+        with open(path + '.part', 'w', encoding='utf-8') as metrics_file:
+            metrics_file.write(self.prometheus_text())
+        replace(path + '.part', path)
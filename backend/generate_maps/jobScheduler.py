@@ -0,0 +1,343 @@
+"""
+This module schedules concurrent map generation jobs in the worker process so
+that they share the Bing Maps API budget fairly, rather than a large map
+starving the small maps requested after it.
+
+Jobs are admitted in the order they are submitted, up to a maximum number of
+running jobs; the rest wait in a queue. Bing Maps API requests of running jobs
+go through a FairQueue that bounds the number of requests in flight across
+every job (the global connection budget). When a request finishes, the next
+request to start is taken from the job that has started the fewest requests so
+far relative to its weight, so running jobs advance in round-robin no matter
+how many requests each has queued. A small map therefore gets every other
+request slot while a large map is running, and finishes in seconds.
+
+Jobs are identified in the FairQueue by their jobMetrics.JobMetrics, which is
+shared by every stage of a job. Requests of jobs that were not run by a
+JobScheduler are not queued.
+
+A map has at most one queued or running job at a time, since jobs of the same
+map write the same files.
+
+The status of queued, running and recently finished jobs can be looked up by
+map id, including the percent complete estimated by JobMetrics.progress() and
+the remaining time extrapolated from it.
+
+Global Variables:
+    JOB_HISTORY: int for the number of finished jobs whose status is kept
+
+Classes:
+    FairQueue: shares concurrent request slots between jobs
+    ScheduledJob: status of a job run by a JobScheduler
+    JobScheduler: queues jobs and shares a request budget between them
+"""
+from asyncio import CancelledError, Semaphore, create_task, get_running_loop
+from collections import deque
+from contextlib import asynccontextmanager
+from time import time
+
+
+JOB_HISTORY = 100
+
+
+class FairQueue:
+    """
+    Shares a number of concurrent slots between tenants with start-time fair
+    queueing. Each tenant has a virtual clock that advances by 1 / weight for
+    every slot it is granted, and free slots go to the waiting tenant with the
+    earliest clock. Tenants start at the clock of the last granted slot, so a
+    new tenant is served right away without taking over the queue.
+
+    Turns still waiting when their tenant is closed keep their place in the
+    queue, since other tenants may be waiting on them (a request shared by
+    several jobs waits its turn under the first job that made it).
+
+    Attributes:
+        slots: int for the number of slots
+        in_use: int count of granted slots
+    """
+
+    def __init__(self, slots):
+        self.slots = slots
+        self.in_use = 0
+        self.clock = 0
+        self.tenants = {}
+        self.closed = []
+
+    def open(self, tenant, weight=1):
+        """
+        Starts queueing the turns of a tenant, with a share of the slots
+        proportional to weight.
+        """
+        self.tenants[tenant] = {'weight': weight, 'clock': self.clock,
+                                'waiting': deque()}
+
+    def close(self, tenant):
+        """
+        Stops queueing the turns of a tenant. Its turns already waiting are
+        still granted in order.
+        """
+        state = self.tenants.pop(tenant, None)
+        if state is not None and state['waiting']:
+            self.closed.append(state)
+
+    def queues(self):
+        return [*self.tenants.values(), *self.closed]
+
+    def grant(self, state):
+        self.in_use += 1
+        self.clock = state['clock']
+        state['clock'] += 1 / state['weight']
+
+    def release(self):
+        self.in_use -= 1
+        while self.in_use < self.slots:
+            self.closed = [state for state in self.closed
+                           if state['waiting']]
+            waiting = [state for state in self.queues() if state['waiting']]
+            if not waiting:
+                return
+            state = min(waiting, key=lambda state: state['clock'])
+            future = state['waiting'].popleft()
+            if future.done():
+                # Its waiter was cancelled
+                continue
+            self.grant(state)
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def turn(self, tenant):
+        """
+        Context manager that holds a slot for a tenant, waiting for its turn
+        if every slot is in use. Tenants that were not opened are not
+        queued.
+        """
+        state = self.tenants.get(tenant)
+        if state is None:
+            yield
+            return
+
+        if self.in_use < self.slots and not any(
+            other['waiting'] for other in self.queues()
+        ):
+            self.grant(state)
+        else:
+            future = get_running_loop().create_future()
+            state['waiting'].append(future)
+            try:
+                await future
+            except CancelledError:
+                if future.done() and not future.cancelled():
+                    self.release()
+                elif future in state['waiting']:
+                    state['waiting'].remove(future)
+                raise
+
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class ScheduledJob:
+    """
+    Status of a job run by a JobScheduler.
+
+    Attributes:
+        map_id: string for the map id of the job
+        metrics: jobMetrics.JobMetrics of the job
+        state: string for "queued", "running", "done" or "failed"
+        queued: float for the Unix time the job was submitted
+        started: float for the Unix time the job started running, or None
+        finished: float for the Unix time the job finished, or None
+        error: string describing why the job failed, or None
+    """
+
+    def __init__(self, map_id, metrics):
+        self.map_id = map_id
+        self.metrics = metrics
+        self.state = 'queued'
+        self.queued = time()
+        self.started = None
+        self.finished = None
+        self.error = None
+
+    def status(self):
+        """
+        Returns a JSON serializable dictionary with the following attributes:
+            "mapId": string for the map id of the job
+            "state": string for "queued", "running", "done" or "failed"
+            "percent": float between 0-100 estimating how much of the job is
+                complete
+            "eta": float estimating the remaining time (s) of a running job,
+                or None if it cannot be estimated yet
+            "queuedAt", "startedAt", "finishedAt": floats for the Unix times
+                the job was submitted, started and finished, or None
+            "error": string describing why the job failed, or None
+        """
+        eta = None
+        if self.state == 'done':
+            percent = 100
+        elif self.state == 'running':
+            progress = self.metrics.progress()
+            percent = round(progress * 100, 1)
+            if progress:
+                eta = (time() - self.started) * (1 - progress) / progress
+        else:
+            percent = round(self.metrics.progress() * 100, 1)
+        return {
+            'mapId': self.map_id,
+            'state': self.state,
+            'percent': percent,
+            'eta': eta,
+            'queuedAt': self.queued,
+            'startedAt': self.started,
+            'finishedAt': self.finished,
+            'error': self.error
+        }
+
+
+class JobScheduler:
+    """
+    Queues jobs, runs at most max_running of them at once and shares a
+    request budget between the running jobs.
+
+    Attributes:
+        requests: FairQueue that Bing Maps API requests of running jobs take
+            turns in
+        jobs: dictionary mapping map ids to the ScheduledJob of their latest
+            job, in submission order
+    """
+
+    def __init__(self, max_running, request_slots):
+        """
+        Args:
+            max_running: integer representing the maximum number of jobs
+                running at once.
+            request_slots: integer representing the maximum number of Bing
+                Maps API requests in flight across every running job.
+        """
+        self.running = Semaphore(max_running)
+        self.requests = FairQueue(request_slots)
+        self.jobs = {}
+        self.tasks = set()
+
+    async def run(self, map_id, metrics, coroutine, weight=1):
+        """
+        Queues a job and runs it once admitted.
+
+        Args:
+            map_id: string representing the map id of the job.
+            metrics: jobMetrics.JobMetrics of the job, which its requests
+                take turns with in requests.
+            coroutine: coroutine running the job.
+            weight: integer or float representing the share of the request
+                slots given to the job relative to other running jobs.
+
+        Returns:
+            The return value of coroutine.
+
+        Raises:
+            ValueError: if the map already has a queued or running job.
+        """
+        try:
+            job = self.enqueue(map_id, metrics)
+        except ValueError:
+            coroutine.close()
+            raise
+        return await self.execute(job, coroutine, weight)
+
+    def check_idle(self, map_id):
+        """
+        Raises ValueError if a map has a queued or running job.
+        """
+        job = self.jobs.get(map_id)
+        if job is not None and job.state in ('queued', 'running'):
+            raise ValueError(f"Map {map_id} already has a {job.state} job")
+
+    def enqueue(self, map_id, metrics):
+        self.check_idle(map_id)
+        job = ScheduledJob(map_id, metrics)
+        self.jobs.pop(map_id, None)
+        self.jobs[map_id] = job
+        return job
+
+    async def execute(self, job, coroutine, weight):
+        metrics = job.metrics
+        try:
+            async with self.running:
+                job.state = 'running'
+                job.started = time()
+                self.requests.open(metrics, weight)
+                try:
+                    result = await coroutine
+                finally:
+                    self.requests.close(metrics)
+        except BaseException as err:
+            coroutine.close()
+            job.state = 'failed'
+            job.error = repr(err)
+            raise
+        finally:
+            job.finished = time()
+            self.forget_finished()
+
+        job.state = 'done'
+        return result
+
+    def submit(self, map_id, metrics, coroutine, weight=1):
+        """
+        Runs a job in the background as in run().
+
+        Returns:
+            The asyncio Task of the job.
+
+        Raises:
+            ValueError: if the map already has a queued or running job.
+        """
+        # The job is queued right away so that its status can be looked up
+        try:
+            job = self.enqueue(map_id, metrics)
+        except ValueError:
+            coroutine.close()
+            raise
+        task = create_task(self.execute(job, coroutine, weight))
+        self.tasks.add(task)
+        task.add_done_callback(self.forget_task)
+        return task
+
+    def forget_task(self, task):
+        # Failures are reported by status(), so they are not raised again
+        self.tasks.discard(task)
+        if not task.cancelled():
+            task.exception()
+
+    def forget_finished(self):
+        finished = [map_id for map_id, job in self.jobs.items()
+                    if job.finished is not None]
+        for map_id in finished[:-JOB_HISTORY or None]:
+            del self.jobs[map_id]
+
+    def status(self, map_id=None):
+        """
+        Returns the status of the latest job of a map as described in
+        ScheduledJob.status(), or a list of the status of every known job if
+        map_id is not provided. Queued jobs also have attribute "position"
+        for the number of jobs queued before them.
+
+        Raises:
+            ValueError: if the map has no known job.
+        """
+        statuses = []
+        position = 0
+        for job in self.jobs.values():
+            status = job.status()
+            if job.state == 'queued':
+                status['position'] = position
+                position += 1
+            if job.map_id == map_id:
+                return status
+            statuses.append(status)
+        if map_id is not None:
+            raise ValueError(f"Map {map_id} has no known job")
+        return statuses
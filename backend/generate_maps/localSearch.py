@@ -2,16 +2,33 @@
 This module contains methods to assist with making requests for the Bing Maps
 Local Search API.
 
+Business type IDs are either categories (such as "EatDrink") or the member
+types of one or more categories (such as "Pizza"). A category request returns
+businesses of all of its member types.
+
 Functions:
     validate_types: validates API business type IDs
+    normalize_types: removes business type IDs made redundant by others
     construct_request: constructs API request url
     validate_request_parameters: validates construct_request parameters
+    compile_accessors: compiles attribute paths into accessor functions
     parse_locations: generator that parses JSON data from an API response
+    parse_response: parses every search result of an API response at once
     search_grid: generator that splits a search region into an even grid
+    split_grid: splits a search grid into four equal quadrants
+
+Global Variables:
+    LOCAL_SEARCH_URL: string for the Local Search API url used by
+        construct_request
 """
 from numpy import arange
 
 
+LOCAL_SEARCH_URL = "https://dev.virtualearth.net/REST/v1/LocalSearch/"
+
+compiled_accessors = {}
+
+
 type_identifiers = {
     'EatDrink': {
         'Bars', 'BarsGrillsAndPubs', 'BelgianRestaurants',
@@ -54,6 +71,15 @@ type_identifiers = {
 }
 
 
+# Inverted index of type_identifiers mapping every type ID to the categories
+# it belongs to, where categories belong to no category
+type_categories = {}
+for category, members in type_identifiers.items():
+    type_categories.setdefault(category, set())
+    for member in members:
+        type_categories.setdefault(member, set()).add(category)
+
+
 def validate_types(types):
     """
     Verifies that a list of type IDs contains valid strings for the Local
@@ -67,16 +93,31 @@ def validate_types(types):
         True if every element in types is present in type_identifiers and False
         if not.
     """
-    for type_id in types:
-        found = False
-        for category in type_identifiers:
-            if type_id == category or type_id in type_identifiers[category]:
-                found = True
-                break
+    if type(types) is str:
+        types = types.split()
+    return all(type_id in type_categories for type_id in types)
+
+
+def normalize_types(types):
+    """
+    Removes repeated type IDs and type IDs whose category is also present, so
+    that no business type is requested twice.
+
+    Args:
+        types: a list or tuple of strings containing type IDs.
 
-        if not found:
-            return False
-    return True
+    Returns:
+        A tuple of the remaining type IDs, in their original order.
+    """
+    selected = set(types)
+    normalized = []
+    for type_id in types:
+        if type_id in normalized:
+            continue
+        if selected.intersection(type_categories.get(type_id, ())):
+            continue
+        normalized.append(type_id)
+    return tuple(normalized)
 
 
 def construct_request(query=None,
@@ -135,7 +176,7 @@ def construct_request(query=None,
                                     userCircularMapView, userLocation,
                                     userMapView, key)
 
-    url = f"https://dev.virtualearth.net/REST/v1/LocalSearch/?key={key}"
+    url = f"{LOCAL_SEARCH_URL}?key={key}"
 
     if query:
         url += f"&query={query.replace(' ', '%20')}"
@@ -183,6 +224,62 @@ def validate_request_parameters(query=None,
         raise ValueError("key must be provided")
 
 
+def compile_accessor(item):
+    levels = tuple(int(level) if level.isdigit() else level
+                   for level in item.split('.'))
+
+    # Paths of one or two levels (every attribute but geocodePoints) avoid
+    # the loop over levels
+    if len(levels) == 1:
+        key = levels[0]
+
+        def accessor(location_dict):
+            try:
+                return location_dict[key]
+            except (KeyError, IndexError, TypeError):
+                return None
+    elif len(levels) == 2:
+        key, subkey = levels
+
+        def accessor(location_dict):
+            try:
+                return location_dict[key][subkey]
+            except (KeyError, IndexError, TypeError):
+                return None
+    else:
+        def accessor(location_dict):
+            try:
+                data_entry = location_dict
+                for level in levels:
+                    data_entry = data_entry[level]
+                return data_entry
+            except (KeyError, IndexError, TypeError):
+                return None
+
+    return accessor
+
+
+def compile_accessors(items):
+    """
+    Compiles attribute paths into accessor functions. Compiled accessors are
+    cached, so each set of attribute paths is only compiled once.
+
+    Args:
+        items: a list or tuple containing strings specifying attributes, as
+            described in parse_locations().
+
+    Returns:
+        A tuple of functions in the same order as items, each taking a search
+        result dictionary and returning the value of its attribute, or None if
+        the attribute does not exist.
+    """
+    items = tuple(items)
+    if items not in compiled_accessors:
+        compiled_accessors[items] = tuple(
+            compile_accessor(item) for item in items)
+    return compiled_accessors[items]
+
+
 def parse_locations(response, items=None):
     """
     Generator that retrieves location data from a JSON response given by the
@@ -228,33 +325,51 @@ def parse_locations(response, items=None):
             items=["name", "geocodePoints.0.calculationMethod"].
 
     Yields:
-        A list of string values corresponding to attributes specified in items
-        for each search result, in identical order. Returns None if attribute
-        does not exist. Returns dictionary of
-        entire search result if items is not specified.
+        A tuple of string values corresponding to attributes specified in
+        items for each search result, in identical order. Returns None if
+        attribute does not exist, including missing list elements and null
+        levels. Returns dictionary of entire search result if items is not
+        specified.
 
     Raises:
         KeyError: if JSON dictionary is invalid.
     """
-    if items:
-        items_split = tuple(tuple(item.split(".")) for item in items)
-    for location_dict in response['resourceSets'][0]['resources']:
-        if not items:
-            yield location_dict
-        else:
-            location_data = []
-            for item_levels in items_split:
-                try:
-                    data_entry = location_dict[item_levels[0]]
-                    for item_level in item_levels[1:]:
-                        if item_level.isdigit():
-                            item_level = int(item_level)
-                        data_entry = data_entry[item_level]
-                except KeyError:
-                    data_entry = None
-                location_data.append(data_entry)
-
-            yield location_data
+    resources = response['resourceSets'][0]['resources']
+    if not items:
+        yield from resources
+        return
+
+    accessors = compile_accessors(items)
+    for location_dict in resources:
+        yield tuple([accessor(location_dict) for accessor in accessors])
+
+
+def parse_response(response, items, columns=False):
+    """
+    Parses every search result of a Local Search API JSON response at once.
+
+    Args:
+        response: dictionary created from a Local Search API JSON response.
+        items: a list or tuple containing strings specifying the desired
+            attributes, as described in parse_locations().
+        columns: boolean toggling column mode, which returns one list per
+            attribute instead of one tuple per search result.
+
+    Returns:
+        A list of tuples as yielded by parse_locations(), or in column mode a
+        tuple of lists in the same order as items, each holding the values of
+        one attribute for every search result.
+
+    Raises:
+        KeyError: if JSON dictionary is invalid.
+    """
+    resources = response['resourceSets'][0]['resources']
+    accessors = compile_accessors(items)
+    if columns:
+        return tuple([accessor(location_dict) for location_dict in resources]
+                     for accessor in accessors)
+    return [tuple([accessor(location_dict) for accessor in accessors])
+            for location_dict in resources]
 
 
 def search_grid(coordinates, lat_partition, long_partition, set_size=False):
@@ -319,3 +434,36 @@ def search_grid(coordinates, lat_partition, long_partition, set_size=False):
                 min(grid_lat + lat_step, ne_lat),
                 min(grid_long + long_step, ne_long)
             )
+
+
+def split_grid(grid):
+    """
+    Splits a rectangular search grid into four equally sized quadrants. Used
+    to refine grids whose Local Search API responses are saturated.
+
+    Args:
+        grid: a list or tuple of 4 floats specifying two corners of a
+            rectangular search region, in the same order as search_grid().
+
+    Returns:
+        A tuple of 4 grids (southwest, southeast, northwest, northeast), each a
+        tuple of 4 floats in the same order as search_grid().
+
+    Raises:
+        ValueError: if grid coordinates do not form a rectangle.
+    """
+    sw_lat, sw_long, ne_lat, ne_long = grid
+
+    if sw_lat > ne_lat or sw_long > ne_long:
+        raise ValueError("Coordinates must form a rectangle (sw_lat < " +
+                         "ne_lat, sw_long < ne_long)")
+
+    mid_lat = (sw_lat + ne_lat) / 2
+    mid_long = (sw_long + ne_long) / 2
+
+    return (
+        (sw_lat, sw_long, mid_lat, mid_long),
+        (sw_lat, mid_long, mid_lat, ne_long),
+        (mid_lat, sw_long, ne_lat, mid_long),
+        (mid_lat, mid_long, ne_lat, ne_long)
+    )
@@ -0,0 +1,353 @@
+"""
+This module contains methods to assist with reading, writing and converting
+map files.
+
+Besides the JSON map file format written by mapWriter.MapWriter, maps can be
+stored in a compact columnar format (file extension .cmap). Instead of
+repeating every key in every map object, each attribute is stored as one
+column:
+    "c": two float32 arrays of latitudes and longitudes, NaN for map objects
+        without coordinates
+    "n", "a", "t", "p", "w": dictionary encoded string columns, each made of a
+        table of unique strings and an array of indices into that table, using
+        the smallest unsigned integer width that fits the table. The largest
+        index value of that width represents None.
+
+A columnar map file is laid out as follows, with all integers and floats in
+little-endian byte order:
+    4 bytes: magic string b'BFMC'
+    4 bytes: uint32 length of the header
+    header: UTF-8 JSON object with "version", "count" and "columns", where
+        "columns" maps each column name to its array type code and the byte
+        offset and length of each of its sections relative to the end of the
+        header
+    sections: raw column data
+
+Coordinates are stored with float32 precision (within about a meter), so
+converting a columnar map back to JSON rounds coordinates to
+COORDINATE_PRECISION decimal places.
+
+Map files can also be precompressed into gzip (.gz) and, if the optional
+brotli package is installed, brotli (.br) siblings that can be served as-is.
+
+Global Variables:
+    COLUMNAR_MAGIC: bytes for the magic string of columnar map files
+    COLUMNAR_VERSION: int for the version of the columnar map file format
+    COORDINATE_PRECISION: int for decimal places of coordinates read from
+        columnar map files
+    STRING_COLUMNS: tuple of strings for the dictionary encoded map object
+        attributes
+
+Functions:
+    iter_map_objects: generator that reads map objects from a map file
+    write_columnar: writes map objects to a columnar map file
+    read_columnar: reads map objects from a columnar map file
+    compress_map_file: writes precompressed siblings of a map file
+    convert_map_file: converts a map file between JSON and columnar formats
+    write_map_variants: writes the columnar and precompressed variants of a
+        JSON map file
+
+When invoked directly, the following arguments convert a map file:
+
+Arguments:
+    source: file path of the map file to convert (.json, .jsonl or .cmap)
+    target: file path of the converted map file (.json, .jsonl or .cmap)
+"""
+from array import array
+from gzip import compress as gzip_compress
+from json import dumps, loads
+from mapWriter import MapWriter
+from math import isnan
+from os import replace
+from os.path import splitext
+from struct import pack, unpack
+import sys
+
+try:
+    from brotli import compress as brotli_compress
+except ImportError:
+    brotli_compress = None
+
+
+COLUMNAR_MAGIC = b'BFMC'
+COLUMNAR_VERSION = 1
+COORDINATE_PRECISION = 6
+STRING_COLUMNS = ('n', 'a', 't', 'p', 'w')
+
+
+def iter_map_objects(path):
+    """
+    Generator that reads map objects from a map file one at a time.
+
+    Args:
+        path: string representing the file path of a .json, .jsonl or .cmap
+            map file.
+
+    Yields:
+        A dictionary for each map object in the map file, in file order.
+    """
+    if path.endswith('.cmap'):
+        yield from read_columnar(path)
+        return
+
+    # Map files written by MapWriter hold one map object per line. Other JSON
+    # map files are parsed whole.
+    with open(path, 'r', encoding='utf-8') as map_file:
+        for line in map_file:
+            line = line.strip().rstrip(',')
+            if line in ('', '[', ']'):
+                continue
+            map_object = loads(line)
+            if type(map_object) is list:
+                yield from map_object
+            else:
+                yield map_object
+
+
+def index_code(size):
+    """
+    Returns the smallest unsigned array type code that can index a table of
+    the given size, leaving the largest value free to represent None.
+    """
+    for code in ('B', 'H', 'I'):
+        if size < 256 ** array(code).itemsize - 1:
+            return code
+    return 'Q'
+
+
+def little_endian(column):
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def write_columnar(map_objects, path):
+    """
+    Writes map objects to a columnar map file. The file is written to a
+    temporary file first and atomically renamed.
+
+    Args:
+        map_objects: an iterable of map object dictionaries.
+        path: string representing the file path of the columnar map file.
+
+    Returns:
+        An integer count of the map objects written.
+    """
+    latitudes = array('f')
+    longitudes = array('f')
+    tables = {column: {} for column in STRING_COLUMNS}
+    indices = {column: [] for column in STRING_COLUMNS}
+
+    count = 0
+    for map_object in map_objects:
+        coords = map_object.get('c') or (float('nan'), float('nan'))
+        latitudes.append(coords[0])
+        longitudes.append(coords[1])
+        for column in STRING_COLUMNS:
+            value = map_object.get(column)
+            if value is None:
+                indices[column].append(None)
+            else:
+                indices[column].append(
+                    tables[column].setdefault(value, len(tables[column])))
+        count += 1
+
+    sections = []
+    columns = {}
+
+    def add_section(data):
+        offset = sum(len(section) for section in sections)
+        sections.append(data)
+        return [offset, len(data)]
+
+    columns['c'] = {
+        'code': 'f',
+        'latitudes': add_section(little_endian(latitudes)),
+        'longitudes': add_section(little_endian(longitudes))
+    }
+    for column in STRING_COLUMNS:
+        table = tables[column]
+        code = index_code(len(table))
+        null = 256 ** array(code).itemsize - 1
+        column_indices = array(code, (null if index is None else index
+                                      for index in indices[column]))
+        strings = [value.encode('utf-8') for value in table]
+        offsets = array('I', [0])
+        for string in strings:
+            offsets.append(offsets[-1] + len(string))
+
+        columns[column] = {
+            'code': code,
+            'indices': add_section(little_endian(column_indices)),
+            'offsets': add_section(little_endian(offsets)),
+            'strings': add_section(b''.join(strings))
+        }
+
+    header = dumps({
+        'version': COLUMNAR_VERSION,
+        'count': count,
+        'columns': columns
+    }).encode('utf-8')
+
+    temp_path = path + '.part'
+    with open(temp_path, 'wb') as map_file:
+        map_file.write(COLUMNAR_MAGIC)
+        map_file.write(pack('<I', len(header)))
+        map_file.write(header)
+        for section in sections:
+            map_file.write(section)
+    replace(temp_path, path)
+    return count
+
+
+def read_section(data, start, code, section):
+    offset, length = section
+    column = array(code)
+    column.frombytes(data[start + offset:start + offset + length])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column
+
+
+def read_columnar(path):
+    """
+    Reads map objects from a columnar map file.
+
+    Args:
+        path: string representing the file path of the columnar map file.
+
+    Returns:
+        A list of map object dictionaries, identical to those in the JSON map
+        file apart from coordinate precision.
+
+    Raises:
+        ValueError: if the file is not a supported columnar map file.
+    """
+    with open(path, 'rb') as map_file:
+        data = map_file.read()
+
+    if data[:4] != COLUMNAR_MAGIC:
+        raise ValueError("Not a columnar map file")
+    header_length, = unpack('<I', data[4:8])
+    header = loads(data[8:8 + header_length].decode('utf-8'))
+    if header['version'] != COLUMNAR_VERSION:
+        raise ValueError(
+            f"Unsupported columnar map file version {header['version']}")
+    start = 8 + header_length
+    columns = header['columns']
+
+    coordinate_column = columns['c']
+    latitudes = read_section(data, start, 'f',
+                             coordinate_column['latitudes'])
+    longitudes = read_section(data, start, 'f',
+                              coordinate_column['longitudes'])
+
+    values = {}
+    for column in STRING_COLUMNS:
+        column_info = columns[column]
+        offsets = read_section(data, start, 'I', column_info['offsets'])
+        string_offset = start + column_info['strings'][0]
+        table = [
+            data[string_offset + offsets[i]:string_offset + offsets[i + 1]]
+            .decode('utf-8')
+            for i in range(len(offsets) - 1)
+        ]
+        column_indices = read_section(data, start, column_info['code'],
+                                      column_info['indices'])
+        values[column] = [
+            table[index] if index < len(table) else None
+            for index in column_indices
+        ]
+
+    map_objects = []
+    for i in range(header['count']):
+        coords = None
+        if not isnan(latitudes[i]):
+            coords = [round(latitudes[i], COORDINATE_PRECISION),
+                      round(longitudes[i], COORDINATE_PRECISION)]
+        map_object = {
+            'n': values['n'][i],
+            'c': coords,
+            'a': values['a'][i],
+            't': values['t'][i],
+            'p': values['p'][i],
+            'w': values['w'][i]
+        }
+        map_objects.append(map_object)
+    return map_objects
+
+
+def compress_map_file(path):
+    """
+    Writes precompressed siblings of a map file: path.gz, and path.br if the
+    brotli package is installed.
+
+    Args:
+        path: string representing the file path of the map file.
+
+    Returns:
+        A list of strings representing the file paths written.
+    """
+    with open(path, 'rb') as map_file:
+        data = map_file.read()
+
+    compressors = [('gz', lambda data: gzip_compress(data, compresslevel=9))]
+    if brotli_compress is not None:
+        compressors.append(('br', brotli_compress))
+
+    written = []
+    for extension, compress in compressors:
+        compressed_path = f'{path}.{extension}'
+        with open(compressed_path + '.part', 'wb') as compressed_file:
+            compressed_file.write(compress(data))
+        replace(compressed_path + '.part', compressed_path)
+        written.append(compressed_path)
+    return written
+
+
+def convert_map_file(source, target):
+    """
+    Converts a map file between the JSON, JSON Lines and columnar formats,
+    choosing each format from its file extension.
+
+    Args:
+        source: string representing the file path of the map file to convert.
+        target: string representing the file path of the converted map file.
+
+    Returns:
+        An integer count of the map objects converted.
+    """
+    map_objects = iter_map_objects(source)
+    if target.endswith('.cmap'):
+        return write_columnar(map_objects, target)
+
+    with MapWriter(
+        target, 'jsonl' if target.endswith('.jsonl') else 'json'
+    ) as writer:
+        for map_object in map_objects:
+            writer.write(map_object)
+    return writer.count
+
+
+def write_map_variants(path):
+    """
+    Writes the columnar variant of a JSON or JSON Lines map file next to it,
+    then precompressed siblings of both files.
+
+    Args:
+        path: string representing the file path of the map file.
+
+    Returns:
+        A list of strings representing the file paths written.
+    """
+    columnar_path = splitext(path)[0] + '.cmap'
+    write_columnar(iter_map_objects(path), columnar_path)
+    return ([columnar_path] +
+            compress_map_file(path) +
+            compress_map_file(columnar_path))
+
+
+if __name__ == '__main__':
+    source, target = sys.argv[1:3]
+    print("Converted", convert_map_file(source, target), "map objects")
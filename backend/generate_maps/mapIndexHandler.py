@@ -13,16 +13,37 @@ Map contains the following attributes:
 Each row in Map corresponds to a file in the /maps directory. The file name for
 any corresponding map is id.json.
 
+Database connections are taken from a connection pool that is created on first
+use, so secrets.json is read and the TLS handshake is performed only once per
+pooled connection rather than once per call. Statements are prepared and
+parameterized, and the batch functions run all of their statements in a single
+transaction.
+
+New map ids are allocated by inserting a random id and retrying with a new one
+if the primary key already exists, rather than reading every existing id.
+
 Global Variables:
     MAP_ID_LENGTH: length of the base-64 string for map_index attribute "id"
     MAP_ID_RETRY_LIMIT: retry limit for creating map_index attribute "id"
+    POOL_SIZE: int for the number of pooled database connections
+    MAP_FILE_EXTENSIONS: tuple of strings for the file extensions of map files
+        deleted along with their entry in Map
 
 Functions:
+    retrieve_pool: returns the database connection pool
+    transaction: context manager yielding a cursor inside a transaction
     gen_index: creates table Map in the MySQL Database
-    get_index: returns a list of dictionaries containing contents of Map
+    get_index: returns a list of dictionaries containing contents of Map,
+        optionally paginated and filtered by title prefix
+    get_map: returns a dictionary containing the entry in Map for a map id
     create_index: creates a unique base-64 map id and entry in map_index.json
-    delete_index: deletes an entry from Map and its corresponding file
+    create_indexes: creates entries in Map for many maps in one transaction
+    delete_index: deletes an entry from Map and its corresponding files
+    delete_indexes: deletes many entries from Map and their corresponding files
+        in one transaction
     update_index: updates an entry from Map for attribute "title"
+    update_indexes: updates attribute "title" for many entries in Map in one
+        transaction
 
 When invoked directly, the following input values can be used to call
 delete_index and update_index:
@@ -32,20 +53,37 @@ Input Values:
     map_id: string representing the base-64 unique identifier for the given map
     new_title: string specifying the new value for attribute "title"
 """
+from contextlib import contextmanager
 from json import dumps, loads
 from os import remove
-from os.path import dirname
+from os.path import dirname, join
 from secrets import token_urlsafe
+from shutil import rmtree
+from threading import BoundedSemaphore, Lock
 import mysql.connector
+from mysql.connector.errorcode import ER_DUP_ENTRY
+from mysql.connector.errors import IntegrityError
+from mysql.connector.pooling import MySQLConnectionPool
 
 
 MAP_ID_LENGTH = 10 * 3//4   # multiply length by 3/4 due to Base64 encoding
 MAP_ID_RETRY_LIMIT = 10000
+POOL_SIZE = 4
+MAP_FILE_EXTENSIONS = tuple(
+    f'{map_format}{compression}'
+    for map_format in ('json', 'jsonl', 'cmap')
+    for compression in ('', '.gz', '.br')
+) + ('plan.json', 'events.jsonl', 'metrics.json', 'journal.jsonl',
+     'summary.json')
 FILE_PATH = dirname(__file__)
 
+connection_pool = None
+pool_lock = Lock()
+pool_slots = BoundedSemaphore(POOL_SIZE)
+
 
 def retrieve_secrets():
-    with open(f'{FILE_PATH}/secrets.json', 'r') as secrets:
+    with open(join(FILE_PATH, 'secrets.json'), 'r') as secrets:
         secrets = loads(secrets.read())
         config = {
             'host': secrets['DB_HOST'],
@@ -53,91 +91,204 @@ def retrieve_secrets():
             'password': secrets['DB_PASSWD'],
             'database': secrets['DB_NAME'],
             'client_flags': [mysql.connector.ClientFlag.SSL],
-            'ssl_ca': FILE_PATH + '\' + secrets['DB_CERT']
+            'ssl_ca': join(FILE_PATH, secrets['DB_CERT'])
         }
     return config
 
 
+def retrieve_pool():
+    """
+    Returns the database connection pool, creating it on first use.
+    """
+    global connection_pool
+    with pool_lock:
+        if connection_pool is None:
+            connection_pool = MySQLConnectionPool(pool_name='map_index',
+                                                  pool_size=POOL_SIZE,
+                                                  **retrieve_secrets())
+    return connection_pool
+
+
+@contextmanager
+def transaction(dictionary=False):
+    """
+    Context manager that yields a prepared statement cursor from a pooled
+    connection. The transaction is committed when the block exits normally and
+    rolled back if it raises. Blocks until a pooled connection is available.
+
+    Args:
+        dictionary: boolean toggling dictionary rows instead of tuples.
+    """
+    with pool_slots:
+        db = retrieve_pool().get_connection()
+        cursor = db.cursor(prepared=True, dictionary=dictionary)
+        try:
+            yield cursor
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            cursor.close()
+            db.close()   # returns the connection to the pool
+
+
 def gen_index():
-    config = retrieve_secrets()
-    db = mysql.connector.connect(**config)
-    cursor = db.cursor()
-    create = "CREATE TABLE Map (id VARCHAR(10) PRIMARY KEY, title VARCHAR(100), location VARCHAR(30), bounds VARCHAR(60))"
-    cursor.execute(create)
-    cursor.close()
-    db.close()
-
-
-def get_index():
-    config = retrieve_secrets()
-    db = mysql.connector.connect(**config)
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM Map")
-    results = cursor.fetchall()
-    for result in results:
-        result["location"] = loads(result["location"])
-        result["bounds"] = loads(result["bounds"])
-    cursor.close()
-    db.close()
-    return dumps(results)
+    with transaction() as cursor:
+        cursor.execute("CREATE TABLE Map (id VARCHAR(10) PRIMARY KEY, title VARCHAR(100), location VARCHAR(30), bounds VARCHAR(60))")
+        cursor.execute("CREATE INDEX MapTitle ON Map (title)")
+
+
+def parse_row(row):
+    row["location"] = loads(row["location"])
+    row["bounds"] = loads(row["bounds"])
+    return row
+
+
+def get_index(limit=None, after=None, title_prefix=None):
+    """
+    Returns entries in Map ordered by id. Pages are selected by keyset rather
+    than by offset, so each page costs the same regardless of its position.
+
+    Args:
+        limit: integer representing the maximum number of entries to return.
+            Returns every entry if not provided.
+        after: string representing the id of the last entry of the previous
+            page. Only entries with a greater id are returned.
+        title_prefix: string that returned entry titles must start with.
+
+    Returns:
+        A list of dictionaries with keys "id", "title", "location" and
+        "bounds".
+    """
+    query = "SELECT id, title, location, bounds FROM Map"
+    conditions = []
+    params = []
+    if after:
+        conditions.append("id > %s")
+        params.append(after)
+    if title_prefix:
+        conditions.append("title LIKE %s")
+        params.append(escape_like(title_prefix) + '%')
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY id"
+    if limit:
+        query += " LIMIT %s"
+        params.append(int(limit))
+
+    with transaction(dictionary=True) as cursor:
+        cursor.execute(query, params)
+        results = cursor.fetchall()
+    return [parse_row(result) for result in results]
+
+
+def get_map(map_id):
+    """
+    Returns the entry in Map for a map id as a dictionary with keys "id",
+    "title", "location" and "bounds", or None if it does not exist.
+    """
+    with transaction(dictionary=True) as cursor:
+        cursor.execute(
+            "SELECT id, title, location, bounds FROM Map WHERE id = %s",
+            (map_id,))
+        result = cursor.fetchone()
+    return parse_row(result) if result else None
+
+
+def escape_like(value):
+    return (value.replace('\\', '\\\\')
+                 .replace('%', '\\%')
+                 .replace('_', '\\_'))
 
 
 def create_index(map_title, location, bounds):
-    config = retrieve_secrets()
-    db = mysql.connector.connect(**config)
-    cursor = db.cursor()
-    cursor.execute("SELECT id FROM Map")
-    results = cursor.fetchall()
-    covered_names = set(result[0] for result in results)
-
-    new_id = token_urlsafe(MAP_ID_LENGTH)
-    iterations = 0
-    while new_id in covered_names:
-        new_id = token_urlsafe(MAP_ID_LENGTH)
-        iterations += 1
-        if iterations >= MAP_ID_RETRY_LIMIT:
-            raise ValueError("Map ID creation failed")
-
-    insert = (
-        new_id,
-        map_title,
-        str(location),
-        str(bounds)
-    )
-    cursor.execute(
-        f"INSERT INTO Map (id, title, location, bounds) VALUES {insert}")
-    db.commit()
-    cursor.close()
-    db.close()
-    return new_id
+    return create_indexes([(map_title, location, bounds)])[0]
+
+
+def create_indexes(entries):
+    """
+    Creates entries in Map with unique base-64 map ids in one transaction.
+    Each id is inserted directly and replaced if it collides with an existing
+    primary key.
+
+    Args:
+        entries: a list or tuple of (map_title, location, bounds) tuples.
+
+    Returns:
+        A list of the new map ids, in the same order as entries.
+
+    Raises:
+        ValueError: if a unique map id could not be created.
+    """
+    new_ids = []
+    with transaction() as cursor:
+        for map_title, location, bounds in entries:
+            for _ in range(MAP_ID_RETRY_LIMIT):
+                new_id = token_urlsafe(MAP_ID_LENGTH)
+                try:
+                    cursor.execute(
+                        "INSERT INTO Map (id, title, location, bounds) " +
+                        "VALUES (%s, %s, %s, %s)",
+                        (new_id, map_title, str(location), str(bounds))
+                    )
+                except IntegrityError as err:
+                    if err.errno != ER_DUP_ENTRY:
+                        raise
+                    continue
+                new_ids.append(new_id)
+                break
+            else:
+                raise ValueError("Map ID creation failed")
+    return new_ids
 
 
 def delete_index(map_id):
-    config = retrieve_secrets()
-    db = mysql.connector.connect(**config)
-    cursor = db.cursor()
-    cursor.execute(f"DELETE FROM Map WHERE id='{map_id}'")
-    db.commit()
-    cursor.close()
-    db.close()
+    delete_indexes([map_id])
 
-    try:
-        remove(f'{FILE_PATH}\maps\{map_id}.json')
-    except OSError:
-        pass
+
+def delete_indexes(map_ids):
+    """
+    Deletes many entries from Map in one transaction, then deletes their
+    corresponding map files.
+
+    Args:
+        map_ids: a list or tuple of strings representing map ids.
+    """
+    with transaction() as cursor:
+        cursor.executemany("DELETE FROM Map WHERE id = %s",
+                           [(map_id,) for map_id in map_ids])
+
+    for map_id in map_ids:
+        for extension in MAP_FILE_EXTENSIONS:
+            try:
+                remove(join(FILE_PATH, 'maps', f'{map_id}.{extension}'))
+            except OSError:
+                pass
+        rmtree(join(FILE_PATH, 'maps', f'{map_id}.tiles'), ignore_errors=True)
 
 
 def update_index(map_id, new_title):
-    if not new_title:
+    update_indexes([(map_id, new_title)])
+
+
+def update_indexes(updates):
+    """
+    Updates attribute "title" for many entries in Map in one transaction.
+
+    Args:
+        updates: a list or tuple of (map_id, new_title) tuples.
+
+    Raises:
+        ValueError: if any new title is empty.
+    """
+    if not all(new_title for _, new_title in updates):
         raise ValueError("Invalid new title")
 
-    config = retrieve_secrets()
-    db = mysql.connector.connect(**config)
-    cursor = db.cursor()
-    cursor.execute(f"UPDATE Map SET title='{new_title}' WHERE id='{map_id}'")
-    db.commit()
-    cursor.close()
-    db.close()
+    with transaction() as cursor:
+        cursor.executemany("UPDATE Map SET title = %s WHERE id = %s",
+                           [(new_title, map_id)
+                            for map_id, new_title in updates])
 
 
 if __name__ == '__main__':
@@ -147,7 +298,7 @@ if __name__ == '__main__':
     if mode == 'GEN':
         gen_index()
     elif mode == 'GET':
-        print(get_index())
+        print(dumps(get_index()))
     elif mode == 'DELETE':
         map_id = input()
         delete_index(map_id)
@@ -0,0 +1,102 @@
+"""
+This module contains the journal of a map generation job, so that a job that
+crashes or is killed partway through can be resumed without requesting the
+completed search grids from the Bing Maps API again.
+
+Each completed Local Search request is appended to {id}.journal.jsonl as soon
+as its response is parsed, one JSON object per line with the following
+attributes:
+    "k": string for the responseCache.cache_key() of the request, which
+        identifies its search grid and business types
+    "r": list of the parsed businesses of the response, each a list of the
+        values of generateMapData.desired_attributes
+
+Lines are flushed as they are written, so they survive the process being
+killed. A line left incomplete by a crash is truncated when the journal is
+reopened. Only the requests read from an existing journal are kept in memory,
+until they are replayed, so journaling a job does not hold on to every
+response it receives.
+
+Classes:
+    MapJournal: append-only journal of completed requests of a map
+"""
+from json import JSONDecodeError, dumps, loads
+from os import remove, truncate
+from os.path import getsize, isfile
+
+
+class MapJournal:
+    """
+    Append-only journal of the completed Local Search requests of a map.
+
+    Attributes:
+        path: string for the file path of the journal
+        entries: dictionary mapping the key of each request read from an
+            existing journal and not replayed yet to its list of parsed
+            businesses
+    """
+
+    def __init__(self, path):
+        """
+        Opens a journal, replaying the requests already journaled if the file
+        exists.
+
+        Args:
+            path: string representing the file path of the journal.
+        """
+        self.path = path
+        self.entries = {}
+        if isfile(path):
+            self.read()
+        self.file = open(path, 'a', encoding='utf-8')
+
+    def read(self):
+        valid_bytes = 0
+        with open(self.path, 'rb') as journal_file:
+            for line in journal_file:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = loads(line)
+                except (JSONDecodeError, UnicodeDecodeError):
+                    break
+                self.entries[entry['k']] = entry['r']
+                valid_bytes += len(line)
+
+        # Drop a line left incomplete by a crash so that appended lines start
+        # on a new line
+        if valid_bytes < getsize(self.path):
+            truncate(self.path, valid_bytes)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        Returns the parsed businesses of a journaled request and forgets them,
+        or None if the request was not read from the journal.
+        """
+        return self.entries.pop(key, None)
+
+    def record(self, key, businesses):
+        """
+        Appends a completed request and its parsed businesses to the journal.
+        """
+        businesses = [list(business) for business in businesses]
+        self.file.write(dumps({'k': key, 'r': businesses},
+                              ensure_ascii=False) + '\n')
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.file.close()
+
+    def remove(self):
+        """
+        Closes and deletes the journal once the map file is finalized.
+        """
+        self.close()
+        try:
+            remove(self.path)
+        except OSError:
+            pass
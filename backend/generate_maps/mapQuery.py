@@ -0,0 +1,310 @@
+"""
+This module answers queries over the map objects of a map file, so that
+clients can request only the businesses they need (for example one business
+type inside the current viewport) instead of the whole map file.
+
+Maps are loaded once and kept in memory, up to QUERY_CACHE_SIZE maps with the
+least recently queried map evicted first. A map is reloaded if its map file
+changed since it was loaded, for example after a refresh. Each map is loaded
+under its own lock, so loading a large map does not hold up queries of the
+other maps. Each loaded map is indexed with:
+    - a spatial grid of GRID_DIVISIONS x GRID_DIVISIONS cells over its bounds,
+        on attribute "c"
+    - an inverted index from business type to map objects, on attribute "t"
+    - a trigram index over the normalized names and addresses, on attributes
+        "n" and "a", used to find substring matches
+
+Map objects are identified by their position in the map file, and query
+results are returned in that order so they can be paged with a cursor.
+
+Global Variables:
+    MAPS_PATH: string for directory path of map files
+    MAP_FILE_FORMATS: tuple of strings for the map file extensions that are
+        queried, in order of preference
+    QUERY_CACHE_SIZE: int for maximum number of maps kept in memory
+    GRID_DIVISIONS: int for the number of spatial grid cells per side
+    DEFAULT_PAGE_SIZE: int for the number of results returned if no limit is
+        given
+    MAX_PAGE_SIZE: int for maximum number of results returned at once
+
+Functions:
+    load_map: returns the indexed map for a map id, loading it if needed
+    query_map: returns map objects matching a bounding box, business types
+        and text
+
+Classes:
+    MapIndex: indexed map objects of a single map
+"""
+from array import array
+from collections import OrderedDict
+from mapFormats import iter_map_objects
+from math import floor
+from os.path import dirname, getmtime, isfile, join
+from re import fullmatch
+from spatialDedup import ADDRESS_ABBREVIATIONS, normalize_text
+from threading import Lock
+
+
+MAPS_PATH = join(dirname(__file__), 'maps')
+MAP_FILE_FORMATS = ('json', 'jsonl', 'cmap')
+QUERY_CACHE_SIZE = 8
+GRID_DIVISIONS = 128
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+loaded_maps = OrderedDict()
+loaded_maps_lock = Lock()
+map_locks = {}
+
+
+def trigrams(text):
+    return {text[index:index + 3] for index in range(len(text) - 2)}
+
+
+class MapIndex:
+    """
+    Indexed map objects of a single map.
+
+    Attributes:
+        objects: list of map objects in map file order
+        bounds: tuple of 4 floats for the bounding box of the map objects, in
+            the same order as localSearch.search_grid(), or None if no map
+            object has coordinates
+        cells: dictionary mapping spatial grid cells to arrays of positions
+        types: dictionary mapping business types to arrays of positions
+        grams: dictionary mapping trigrams to arrays of positions
+        names: list of normalized names (or None) by position
+        addresses: list of normalized addresses (or None) by position
+    """
+
+    def __init__(self, map_objects):
+        """
+        Args:
+            map_objects: iterable of map object dictionaries.
+        """
+        self.objects = list(map_objects)
+        coords = [map_object['c'] for map_object in self.objects
+                  if map_object.get('c')]
+        if coords:
+            self.bounds = (min(lat for lat, _ in coords),
+                           min(long for _, long in coords),
+                           max(lat for lat, _ in coords),
+                           max(long for _, long in coords))
+        else:
+            self.bounds = None
+
+        self.cells = {}
+        self.types = {}
+        self.grams = {}
+        self.names = []
+        self.addresses = []
+        for position, map_object in enumerate(self.objects):
+            if map_object.get('c'):
+                cell = self.cell_for(*map_object['c'])
+                self.cells.setdefault(cell, array('I')).append(position)
+            if map_object.get('t'):
+                self.types.setdefault(map_object['t'], array('I')).append(
+                    position)
+
+            name = normalize_text(map_object.get('n'))
+            address = normalize_text(map_object.get('a'),
+                                     ADDRESS_ABBREVIATIONS)
+            self.names.append(name)
+            self.addresses.append(address)
+            for gram in trigrams(name or '') | trigrams(address or ''):
+                self.grams.setdefault(gram, array('I')).append(position)
+
+    def cell_for(self, lat, long):
+        sw_lat, sw_long, ne_lat, ne_long = self.bounds
+        row = floor((lat - sw_lat) / ((ne_lat - sw_lat) or 1) *
+                    GRID_DIVISIONS)
+        column = floor((long - sw_long) / ((ne_long - sw_long) or 1) *
+                       GRID_DIVISIONS)
+        return (min(max(row, 0), GRID_DIVISIONS - 1),
+                min(max(column, 0), GRID_DIVISIONS - 1))
+
+    def within(self, bounding_box):
+        """
+        Returns the set of positions of map objects inside a bounding box.
+        """
+        if self.bounds is None:
+            return set()
+        sw_lat, sw_long, ne_lat, ne_long = bounding_box
+        south, west = self.cell_for(sw_lat, sw_long)
+        north, east = self.cell_for(ne_lat, ne_long)
+        positions = set()
+        for row in range(south, north + 1):
+            for column in range(west, east + 1):
+                for position in self.cells.get((row, column), ()):
+                    lat, long = self.objects[position]['c']
+                    if sw_lat <= lat <= ne_lat and sw_long <= long <= ne_long:
+                        positions.add(position)
+        return positions
+
+    def of_types(self, business_types):
+        """
+        Returns the set of positions of map objects of any of the business
+        types.
+        """
+        positions = set()
+        for business_type in business_types:
+            positions.update(self.types.get(business_type, ()))
+        return positions
+
+    def matching(self, text, candidates=None):
+        """
+        Returns the set of positions of map objects whose normalized name or
+        address contains the normalized text, out of candidates if given.
+        """
+        name_text = normalize_text(text) or ''
+        address_text = normalize_text(text, ADDRESS_ABBREVIATIONS) or ''
+
+        # Map objects containing a text contain each of its trigrams, so texts
+        # of at least 3 characters narrow the candidates with the index
+        if len(name_text) >= 3 and len(address_text) >= 3:
+            gram_candidates = set()
+            for query_text in {name_text, address_text}:
+                postings = sorted((self.grams.get(gram, ()) for gram in
+                                   trigrams(query_text)), key=len)
+                matches = set(postings[0])
+                for posting in postings[1:]:
+                    matches.intersection_update(posting)
+                gram_candidates |= matches
+            if candidates is None:
+                candidates = gram_candidates
+            else:
+                candidates = candidates & gram_candidates
+        elif candidates is None:
+            candidates = range(len(self.objects))
+
+        return {position for position in candidates
+                if name_text in (self.names[position] or '') or
+                address_text in (self.addresses[position] or '')}
+
+    def query(self, bounding_box=None, business_types=None, text=None,
+              limit=None, after=None):
+        """
+        Returns the map objects matching every given filter, as described in
+        query_map().
+        """
+        candidates = None
+        if business_types:
+            candidates = self.of_types(business_types)
+        if bounding_box:
+            within = self.within(bounding_box)
+            candidates = within if candidates is None else candidates & within
+        if text:
+            candidates = self.matching(text, candidates)
+
+        if candidates is None:
+            positions = range(len(self.objects))
+        else:
+            positions = sorted(candidates)
+
+        total = len(positions)
+        if after is not None:
+            positions = [position for position in positions
+                         if position > after]
+
+        limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+        page = positions[:limit]
+        return {
+            'total': total,
+            'results': [self.objects[position] for position in page],
+            'next': page[-1] if len(positions) > limit else None
+        }
+
+
+def find_map_file(map_id):
+    if not fullmatch(r'[A-Za-z0-9_-]+', map_id or ''):
+        raise ValueError(f"Invalid map id {map_id}")
+    for map_format in MAP_FILE_FORMATS:
+        path = join(MAPS_PATH, f'{map_id}.{map_format}')
+        if isfile(path):
+            return path
+    raise ValueError(f"Map {map_id} has no map file")
+
+
+def loaded_map(map_id, path, modified):
+    # Must be called with loaded_maps_lock held
+    if map_id in loaded_maps:
+        loaded_path, loaded_modified, map_index = loaded_maps[map_id]
+        if loaded_path == path and loaded_modified == modified:
+            loaded_maps.move_to_end(map_id)
+            return map_index
+    return None
+
+
+def load_map(map_id):
+    """
+    Returns the MapIndex of a map, loading and indexing its map file if it is
+    not loaded or changed since it was loaded.
+
+    Raises:
+        ValueError: if the map id is invalid or the map has no map file.
+    """
+    path = find_map_file(map_id)
+    modified = getmtime(path)
+
+    with loaded_maps_lock:
+        map_index = loaded_map(map_id, path, modified)
+        if map_index is not None:
+            return map_index
+        # Each per-map lock counts the queries holding or waiting for it, and
+        # is dropped by the last one so that no other lock replaces it
+        map_lock = map_locks.setdefault(map_id, [Lock(), 0])
+        map_lock[1] += 1
+
+    try:
+        with map_lock[0]:
+            # Another query may have loaded the map while this one waited
+            with loaded_maps_lock:
+                map_index = loaded_map(map_id, path, modified)
+            if map_index is not None:
+                return map_index
+
+            map_index = MapIndex(iter_map_objects(path))
+            with loaded_maps_lock:
+                loaded_maps[map_id] = (path, modified, map_index)
+                loaded_maps.move_to_end(map_id)
+                while len(loaded_maps) > QUERY_CACHE_SIZE:
+                    loaded_maps.popitem(last=False)
+            return map_index
+    finally:
+        with loaded_maps_lock:
+            map_lock[1] -= 1
+            if not map_lock[1]:
+                del map_locks[map_id]
+
+
+def query_map(map_id, bounding_box=None, business_types=None, text=None,
+              limit=None, after=None):
+    """
+    Returns the map objects of a map matching every given filter.
+
+    Args:
+        map_id: string representing the base-64 unique identifier for the map.
+        bounding_box: a list or tuple of 4 floats in the same order as
+            localSearch.search_grid(). Only map objects inside it match.
+        business_types: a list or tuple of strings. Only map objects of one of
+            these business types match.
+        text: string that the name or address of matching map objects must
+            contain, ignoring case, accents, punctuation and address
+            abbreviations.
+        limit: integer representing the maximum number of map objects to
+            return (DEFAULT_PAGE_SIZE if not provided, at most MAX_PAGE_SIZE).
+        after: integer cursor returned as "next" by the previous page.
+
+    Returns:
+        A dictionary with the following attributes:
+            "total": int count of matching map objects
+            "results": list of matching map objects after the cursor, in map
+                file order
+            "next": int cursor for the next page, or None if this is the last
+                page
+
+    Raises:
+        ValueError: if the map id is invalid or the map has no map file.
+    """
+    return load_map(map_id).query(bounding_box, business_types, text, limit,
+                                  after)
@@ -0,0 +1,214 @@
+"""
+This module writes and reads the summary of a map, a small JSON file next to
+the map file ({id}.summary.json) holding the aggregates that charts and map
+listings need, so that they do not have to be recomputed from every map
+object of the map file.
+
+Each summary contains the following attributes:
+    "total": int count of map objects
+    "types": object mapping each business type ("t") to its count
+    "localities": object mapping each locality ("City, ST") parsed from the
+        addresses to its count
+    "postalCodes": object mapping each postal code parsed from the addresses
+        to its count
+    "phoneFraction": float between 0-1 for the fraction of map objects with a
+        phone number
+    "websiteFraction": float between 0-1 for the fraction of map objects with
+        a website
+    "density": object with attributes "boundingBox" (4 floats, in the same
+        order as localSearch.search_grid()), "rows", "columns" and "counts"
+        (a list of rows from south to north, each a list of int counts from
+        west to east), or null if the bounding box is unknown
+    "generation": the jobMetrics.JobMetrics summary of the job that wrote
+        the map file (without its latency histogram), the same as its
+        {id}.metrics.json, or null until the job finishes or if unknown
+
+Summaries are written by generateMapData.finalize_map(), and their generation
+statistics once the job has finished, finalize stage included. Maps finalized
+before summaries existed get theirs written on first read, without generation
+statistics.
+
+Global Variables:
+    MAPS_PATH: string for directory path of map files
+    DENSITY_DIVISIONS: int for the number of density histogram cells per side
+    POSTAL_CODE_PATTERN: string for the regular expression matching a postal
+        code at the end of an address
+
+Functions:
+    parse_locality: returns the locality and postal code of an address
+    summarize_map: returns the summary of map objects
+    write_summary: writes the summary of a map file
+    write_generation: writes the generation statistics of a summary
+    read_summary: reads the summary of a map, writing it if needed
+"""
+from json import dump, load
+from mapFormats import iter_map_objects
+from mapQuery import find_map_file
+from math import floor
+from os import fdopen, remove, replace
+from os.path import basename, dirname, join
+from re import search
+from tempfile import mkstemp
+
+
+MAPS_PATH = join(dirname(__file__), 'maps')
+DENSITY_DIVISIONS = 16
+POSTAL_CODE_PATTERN = r'\d{5}(?:-\d{4})?$'
+
+
+def parse_locality(address):
+    """
+    Returns the locality and postal code of a Bing Maps formatted address
+    such as "1 Main St, Springfield, IL 62701".
+
+    Returns:
+        A tuple (locality, postal_code) where locality is a string such as
+        "Springfield, IL" and postal_code a string such as "62701". Either is
+        None if it cannot be parsed.
+    """
+    if not address:
+        return None, None
+    parts = [part.strip() for part in address.split(',')]
+    if len(parts) < 2:
+        return None, None
+
+    region = parts[-1]
+    postal_code = None
+    match = search(POSTAL_CODE_PATTERN, region)
+    if match:
+        postal_code = match.group(0)
+        region = region[:match.start()].strip()
+
+    locality = f'{parts[-2]}, {region}' if region else parts[-2]
+    return (locality or None), postal_code
+
+
+def summarize_map(map_objects, bounding_box=None):
+    """
+    Returns the summary of map objects, as described above, without
+    generation statistics.
+
+    Args:
+        map_objects: iterable of map object dictionaries.
+        bounding_box: a list or tuple of 4 floats for the bounds of the
+            density histogram, or None to leave it out.
+    """
+    total = phones = websites = 0
+    types = {}
+    localities = {}
+    postal_codes = {}
+    density = None
+    if bounding_box:
+        sw_lat, sw_long, ne_lat, ne_long = bounding_box
+        lat_size = ((ne_lat - sw_lat) or 1) / DENSITY_DIVISIONS
+        long_size = ((ne_long - sw_long) or 1) / DENSITY_DIVISIONS
+        density = [[0] * DENSITY_DIVISIONS for _ in range(DENSITY_DIVISIONS)]
+
+    for map_object in map_objects:
+        total += 1
+        phones += bool(map_object.get('p'))
+        websites += bool(map_object.get('w'))
+        business_type = map_object.get('t')
+        types[business_type] = types.get(business_type, 0) + 1
+
+        locality, postal_code = parse_locality(map_object.get('a'))
+        if locality:
+            localities[locality] = localities.get(locality, 0) + 1
+        if postal_code:
+            postal_codes[postal_code] = postal_codes.get(postal_code, 0) + 1
+
+        coords = map_object.get('c')
+        if density is not None and coords:
+            row = floor((coords[0] - sw_lat) / lat_size)
+            column = floor((coords[1] - sw_long) / long_size)
+            density[min(max(row, 0), DENSITY_DIVISIONS - 1)][
+                min(max(column, 0), DENSITY_DIVISIONS - 1)] += 1
+
+    return {
+        'total': total,
+        'types': types,
+        'localities': localities,
+        'postalCodes': postal_codes,
+        'phoneFraction': phones / total if total else 0,
+        'websiteFraction': websites / total if total else 0,
+        'density': None if density is None else {
+            'boundingBox': list(bounding_box),
+            'rows': DENSITY_DIVISIONS,
+            'columns': DENSITY_DIVISIONS,
+            'counts': density
+        },
+        'generation': None
+    }
+
+
+def dump_summary(summary, summary_path):
+    # Concurrent first reads of a map may write its summary at the same time,
+    # so each writer has its own temporary file
+    fd, temp_path = mkstemp(suffix='.part', prefix=basename(summary_path),
+                            dir=dirname(summary_path))
+    try:
+        with fdopen(fd, 'w', encoding='utf-8') as summary_file:
+            dump(summary, summary_file, ensure_ascii=False)
+        replace(temp_path, summary_path)
+    except BaseException:
+        remove(temp_path)
+        raise
+
+
+def write_summary(map_path, summary_path, bounding_box=None):
+    """
+    Atomically writes the summary of a map file to summary_path, with the
+    density histogram over bounding_box as in summarize_map().
+
+    Returns:
+        The summary dictionary.
+    """
+    summary = summarize_map(iter_map_objects(map_path), bounding_box)
+    dump_summary(summary, summary_path)
+    return summary
+
+
+def write_generation(summary_path, generation):
+    """
+    Atomically sets the generation statistics of the summary at
+    summary_path.
+
+    Args:
+        summary_path: string representing the file path of a summary written
+            by write_summary().
+        generation: dictionary returned by jobMetrics.JobMetrics.summary().
+    """
+    with open(summary_path, 'r', encoding='utf-8') as summary_file:
+        summary = load(summary_file)
+    summary['generation'] = {key: value for key, value in generation.items()
+                             if key != 'latency'}
+    dump_summary(summary, summary_path)
+
+
+def read_summary(map_id):
+    """
+    Reads the summary of a map. Maps without a summary are summarized from
+    their map file (using the bounding box of their generation plan, if any)
+    and the summary is written for later reads.
+
+    Returns:
+        The summary dictionary described above.
+
+    Raises:
+        ValueError: if the map id is invalid or the map has no map file.
+    """
+    map_path = find_map_file(map_id)
+    summary_path = join(MAPS_PATH, f'{map_id}.summary.json')
+    try:
+        with open(summary_path, 'r', encoding='utf-8') as summary_file:
+            return load(summary_file)
+    except FileNotFoundError:
+        pass
+
+    try:
+        with open(join(MAPS_PATH, f'{map_id}.plan.json'), 'r',
+                  encoding='utf-8') as plan_file:
+            bounding_box = load(plan_file).get('boundingBox')
+    except FileNotFoundError:
+        bounding_box = None
+    return write_summary(map_path, summary_path, bounding_box)
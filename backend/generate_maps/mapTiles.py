@@ -0,0 +1,183 @@
+"""
+This module contains methods to assist with splitting a map into a pyramid of
+spatial tiles, so that clients only fetch the part of a map that is visible.
+
+Tiles use the Web Mercator z/x/y scheme used by Leaflet tile layers. Each map
+gets a tile directory next to its map file ({id}.tiles) containing:
+    index.json: a JSON object describing the tile pyramid with the following
+        attributes:
+            "minZoom": int for the lowest zoom level with tiles
+            "pointZoom": int for the zoom level with point tiles
+            "bounds": list of 4 floats for the bounds of the map
+            "count": int for the number of map objects in the map
+            "tiles": object mapping each zoom level to a list of [x, y, count]
+                for every tile that exists at that zoom level
+    {z}/{x}/{y}.json: a JSON object for each non-empty tile
+
+Tiles below pointZoom are cluster tiles. Each tile is divided into a grid of
+CLUSTER_DIVISIONS x CLUSTER_DIVISIONS cells, and the map objects in each cell
+are merged into one cluster:
+    {"clusters": [{"c": [lat, long], "k": count}, ...]}
+where "c" is the mean coordinate of the map objects in the cluster.
+
+Tiles at pointZoom are point tiles holding the map objects themselves:
+    {"points": [map object, ...]}
+Clients zoomed in further than pointZoom use the point tile that contains
+their viewport.
+
+Global Variables:
+    CLUSTER_DIVISIONS: int for the number of cluster cells along each side of a
+        cluster tile
+    MAX_LATITUDE: float for the latitude limit of Web Mercator tiles
+
+Functions:
+    tile_for: returns the x and y tile indices of a coordinate at a zoom level
+    build_tiles: writes the tile pyramid for a map
+"""
+from collections import defaultdict
+from json import dump
+from math import asinh, floor, pi, radians, tan
+from os import makedirs, replace
+from os.path import exists, join
+from shutil import rmtree
+
+
+CLUSTER_DIVISIONS = 8
+MAX_LATITUDE = 85.0511287798
+
+
+def tile_position(lat, long, zoom):
+    """
+    Returns the fractional x and y tile position of a coordinate at a zoom
+    level.
+    """
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = 2 ** zoom
+    x = (long + 180) / 360 * scale
+    y = (1 - asinh(tan(radians(lat))) / pi) / 2 * scale
+    return (min(max(x, 0), scale - 1e-9), min(max(y, 0), scale - 1e-9))
+
+
+def tile_for(lat, long, zoom):
+    """
+    Returns the x and y tile indices containing a coordinate at a zoom level.
+
+    Args:
+        lat: float representing the latitude of the coordinate.
+        long: float representing the longitude of the coordinate.
+        zoom: integer representing the zoom level.
+
+    Returns:
+        A tuple of 2 integers (x, y).
+    """
+    x, y = tile_position(lat, long, zoom)
+    return (floor(x), floor(y))
+
+
+def write_tile(tiles_path, zoom, x, y, tile):
+    tile_directory = join(tiles_path, str(zoom), str(x))
+    makedirs(tile_directory, exist_ok=True)
+    with open(join(tile_directory, f'{y}.json'), 'w',
+              encoding='utf-8') as tile_file:
+        dump(tile, tile_file, ensure_ascii=False)
+
+
+def build_tiles(map_objects, tiles_path, bounds, min_zoom, point_zoom):
+    """
+    Writes the tile pyramid for a map. The pyramid is written to a temporary
+    directory first and renamed into place, replacing any previous pyramid.
+
+    Args:
+        map_objects: an iterable of map object dictionaries.
+        tiles_path: string representing the directory path of the pyramid.
+        bounds: a list or tuple of 4 floats specifying the bounds of the map,
+            as saved by mapIndexHandler.create_index().
+        min_zoom: integer representing the lowest zoom level with tiles.
+        point_zoom: integer representing the zoom level with point tiles.
+            Must be greater than or equal to min_zoom.
+
+    Returns:
+        A dictionary created from the written index.json.
+
+    Raises:
+        ValueError: if point_zoom is less than min_zoom.
+    """
+    if point_zoom < min_zoom:
+        raise ValueError("point_zoom must be greater than or equal to " +
+                         "min_zoom")
+
+    # clusters[zoom][(x, y)][(cell_x, cell_y)] = [count, lat_sum, long_sum]
+    clusters = {zoom: defaultdict(dict) for zoom in range(min_zoom,
+                                                          point_zoom)}
+    points = defaultdict(list)
+    count = 0
+
+    for map_object in map_objects:
+        coords = map_object.get('c')
+        if not coords:
+            continue
+        lat, long = coords
+        count += 1
+
+        for zoom, zoom_clusters in clusters.items():
+            x, y = tile_position(lat, long, zoom)
+            tile_x, tile_y = floor(x), floor(y)
+            cell = (floor((x - tile_x) * CLUSTER_DIVISIONS),
+                    floor((y - tile_y) * CLUSTER_DIVISIONS))
+            cluster = zoom_clusters[(tile_x, tile_y)].get(cell)
+            if cluster is None:
+                zoom_clusters[(tile_x, tile_y)][cell] = [1, lat, long]
+            else:
+                cluster[0] += 1
+                cluster[1] += lat
+                cluster[2] += long
+
+        points[tile_for(lat, long, point_zoom)].append(map_object)
+
+    temp_path = tiles_path + '.part'
+    if exists(temp_path):
+        rmtree(temp_path)
+    makedirs(temp_path)
+
+    tile_index = {
+        'minZoom': min_zoom,
+        'pointZoom': point_zoom,
+        'bounds': list(bounds),
+        'count': count,
+        'tiles': {}
+    }
+    for zoom, zoom_clusters in clusters.items():
+        tile_list = []
+        for (x, y), cells in zoom_clusters.items():
+            tile = {'clusters': [
+                {'c': [lat_sum / cluster_count, long_sum / cluster_count],
+                 'k': cluster_count}
+                for cluster_count, lat_sum, long_sum in cells.values()
+            ]}
+            write_tile(temp_path, zoom, x, y, tile)
+            tile_list.append([x, y, sum(cluster[0]
+                                        for cluster in cells.values())])
+        tile_index['tiles'][str(zoom)] = tile_list
+
+    tile_list = []
+    for (x, y), tile_points in points.items():
+        write_tile(temp_path, point_zoom, x, y, {'points': tile_points})
+        tile_list.append([x, y, len(tile_points)])
+    tile_index['tiles'][str(point_zoom)] = tile_list
+
+    with open(join(temp_path, 'index.json'), 'w',
+              encoding='utf-8') as index_file:
+        dump(tile_index, index_file)
+
+    # The old pyramid is renamed aside rather than deleted first, so tiles
+    # are only missing between two renames instead of during a recursive
+    # delete
+    old_path = tiles_path + '.old'
+    if exists(old_path):
+        rmtree(old_path)
+    if exists(tiles_path):
+        replace(tiles_path, old_path)
+    replace(temp_path, tiles_path)
+    if exists(old_path):
+        rmtree(old_path)
+    return tile_index
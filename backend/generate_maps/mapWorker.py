@@ -0,0 +1,176 @@
+"""
+This module runs a long-lived worker process that handles map generation and
+map index commands, so that the Python interpreter, its imports, the Bing Maps
+API key and the aiohttp session are only set up once rather than once per HTTP
+request.
+
+The worker reads newline-delimited JSON commands from stdin and writes one
+newline-delimited JSON reply to stdout for each command. Commands are handled
+concurrently, so replies may arrive in a different order than their commands.
+Progress messages are written to stderr.
+
+Each command is a JSON object with the following attributes:
+    "id": any JSON value identifying the command, echoed back in its reply
+    "mode": string specifying "GEN", "GET", "MAP", "QUERY", "SUMMARY",
+        "CREATE", "STATUS", "REFRESH", "RESUME", "UPDATE" or "DELETE"
+    "limit", "after", "titlePrefix": optional pagination and filter values
+        for mode "GET"
+    "city", "state", "title", "businessTypes": values for mode "CREATE", where
+        businessTypes is a comma separated string or a list of strings
+    "wait": optional boolean for mode "CREATE", false to reply with the map id
+        as soon as the job is queued instead of once the map is generated
+    "mapId": string representing the map id for modes "MAP", "QUERY",
+        "SUMMARY", "REFRESH", "RESUME", "UPDATE" and "DELETE", and optionally
+        "STATUS" (the status of every known job is returned if not provided)
+    "boundingBox", "businessTypes", "text", "limit", "after": optional
+        filters and pagination values for mode "QUERY", as in
+        mapQuery.query_map()
+    "grids": optional list of search grids to refresh for mode "REFRESH"
+    "newTitle": string representing the new map title for mode "UPDATE"
+
+Each reply is a JSON object with the following attributes:
+    "id": the id of the command being replied to
+    "ok": boolean indicating whether the command succeeded
+    "result": the return value of the command if it succeeded
+    "error": string describing the failure if the command failed
+
+Functions:
+    handle_command: runs a single command and returns its result
+    serve: reads and handles commands until stdin is closed
+"""
+from asyncio import create_task, gather, get_running_loop, run, to_thread
+from generateMapData import (generate_map, open_session, retrieve_api_key,
+                             retrieve_job_scheduler)
+from json import dumps, loads
+from mapIndexHandler import (delete_index, gen_index, get_index, get_map,
+                             update_index)
+from mapQuery import query_map
+from mapSummary import read_summary
+from refreshMap import refresh_map
+from resumeMap import resume_map
+import sys
+
+
+async def handle_command(command, session):
+    """
+    Runs a single worker command.
+
+    Args:
+        command: dictionary created from a JSON command.
+        session: aiohttp ClientSession shared by all map generation jobs.
+
+    Returns:
+        A JSON serializable result for the command.
+
+    Raises:
+        ValueError: if the command mode is invalid.
+    """
+    mode = command.get('mode')
+
+    if mode == 'GEN':
+        return await to_thread(gen_index)
+    elif mode == 'GET':
+        return await to_thread(get_index,
+                               command.get('limit'),
+                               command.get('after'),
+                               command.get('titlePrefix'))
+    elif mode == 'MAP':
+        return await to_thread(get_map, command['mapId'])
+    elif mode == 'QUERY':
+        business_types = command.get('businessTypes')
+        if type(business_types) is str:
+            business_types = business_types.split(',')
+        return await to_thread(query_map,
+                               command['mapId'],
+                               command.get('boundingBox'),
+                               business_types,
+                               command.get('text'),
+                               command.get('limit'),
+                               command.get('after'))
+    elif mode == 'SUMMARY':
+        return await to_thread(read_summary, command['mapId'])
+    elif mode == 'CREATE':
+        business_types = command['businessTypes']
+        if type(business_types) is str:
+            business_types = business_types.split(',')
+        return await generate_map(command['city'],
+                                  command['state'],
+                                  command['title'],
+                                  business_types,
+                                  session,
+                                  command.get('wait', True))
+    elif mode == 'STATUS':
+        return retrieve_job_scheduler().status(command.get('mapId'))
+    elif mode == 'REFRESH':
+        return await refresh_map(command['mapId'],
+                                 session,
+                                 command.get('grids'))
+    elif mode == 'RESUME':
+        return await resume_map(command['mapId'], session)
+    elif mode == 'UPDATE':
+        return await to_thread(update_index,
+                               command['mapId'],
+                               command['newTitle'])
+    elif mode == 'DELETE':
+        return await to_thread(delete_index, command['mapId'])
+
+    raise ValueError(f"Invalid mode {mode}")
+
+
+async def reply(command, session, output):
+    try:
+        result = await handle_command(command, session)
+        response = {'id': command.get('id'), 'ok': True, 'result': result}
+    except Exception as err:
+        response = {'id': command.get('id'), 'ok': False, 'error': repr(err)}
+
+    output.write(dumps(response, ensure_ascii=False) + '\n')
+    output.flush()
+
+
+async def serve(input_stream, output):
+    """
+    Reads newline-delimited JSON commands from input_stream and writes replies
+    to output until input_stream is closed. Pending commands and jobs
+    submitted in the background (mode "CREATE" without waiting) are
+    completed before returning.
+    """
+    loop = get_running_loop()
+    tasks = set()
+
+    async with open_session() as session:
+        while True:
+            line = await loop.run_in_executor(None, input_stream.readline)
+            if not line:
+                break
+            if not line.strip():
+                continue
+
+            try:
+                command = loads(line)
+            except ValueError as err:
+                output.write(dumps({'id': None, 'ok': False,
+                                    'error': repr(err)}) + '\n')
+                output.flush()
+                continue
+
+            task = create_task(reply(command, session, output))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        await gather(*tasks)
+        # Background jobs use the session, so they finish before it closes.
+        # Their failures are reported by their status rather than raised.
+        jobs = retrieve_job_scheduler().tasks
+        while jobs:
+            await gather(*jobs, return_exceptions=True)
+
+
+if __name__ == '__main__':
+    # Keep stdout for replies only; progress messages go to stderr
+    output = sys.stdout
+    sys.stdout = sys.stderr
+
+    retrieve_api_key()
+    print("Worker ready")
+    run(serve(sys.stdin, output))
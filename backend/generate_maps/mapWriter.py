@@ -0,0 +1,159 @@
+"""
+This module contains a streaming writer for map files, so that map objects are
+written to disk as soon as they are retrieved rather than held in memory until
+map generation finishes.
+
+Map objects are written to a temporary file next to the map file (the map file
+path with ".part" appended), one map object per line, which can be tailed to
+follow progress. When the writer is closed, the temporary file is flushed and
+atomically renamed to the map file, so readers never see a partially written
+map file. If map generation fails, the temporary file is removed instead.
+
+Map objects that were already written can be replaced, for example when a more
+complete duplicate is retrieved later. Replacements are kept in memory and
+applied in a single streaming pass over the temporary file when the writer is
+closed.
+
+Two formats are supported:
+    "json": a JSON array of map objects, identical to what json.dump writes
+    "jsonl": JSON Lines, one map object per line
+
+Global Variables:
+    MAP_FORMATS: tuple of strings for the supported map file formats
+
+Classes:
+    MapWriter: streaming, atomically finalized map file writer
+"""
+from json import dumps
+from os import fsync, remove, replace
+
+
+MAP_FORMATS = ('json', 'jsonl')
+
+
+class MapWriter:
+    """
+    Streaming map file writer. Can be used as a context manager, which closes
+    the writer if the block exits normally and aborts it if the block raises.
+
+    Attributes:
+        path: string for the file path of the finalized map file
+        temp_path: string for the file path written to until finalized
+        count: int count of map objects written
+        bytes_written: int count of bytes written
+    """
+
+    def __init__(self, path, map_format='json'):
+        """
+        Args:
+            path: string representing the file path of the map file.
+            map_format: string specifying a format in MAP_FORMATS.
+
+        Raises:
+            ValueError: if map_format is not supported.
+        """
+        if map_format not in MAP_FORMATS:
+            raise ValueError(f"map_format must be one of {MAP_FORMATS}")
+
+        self.path = path
+        self.temp_path = path + '.part'
+        self.map_format = map_format
+        self.count = 0
+        self.bytes_written = 0
+        self.replacements = {}
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        if map_format == 'json':
+            self.write_text('[')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write_text(self, text):
+        self.file.write(text)
+        self.bytes_written += len(text.encode('utf-8'))
+
+    def write(self, map_object):
+        """
+        Appends a map object to the temporary file.
+        """
+        self.write_json(dumps(map_object, ensure_ascii=False))
+
+    def write_json(self, line):
+        """
+        Appends the JSON text of a map object, as written by
+        json.dumps(map_object, ensure_ascii=False), to the temporary file.
+        """
+        if self.map_format == 'json':
+            line = ('\n' if self.count == 0 else ',\n') + line
+        else:
+            line += '\n'
+        self.write_text(line)
+        self.count += 1
+
+    def replace(self, index, map_object):
+        """
+        Replaces the map object written at the given index (in write order)
+        once the writer is closed.
+        """
+        if not 0 <= index < self.count:
+            raise IndexError("map object index out of range")
+        self.replacements[index] = map_object
+
+    def apply_replacements(self):
+        # Map objects are written one per line, so line i of the map objects
+        # holds map object i
+        patched_path = self.temp_path + '.patch'
+        with open(self.temp_path, 'r', encoding='utf-8') as source, open(
+            patched_path, 'w', encoding='utf-8'
+        ) as target:
+            if self.map_format == 'json':
+                target.write(source.readline())
+            for index in range(self.count):
+                line = source.readline()
+                if index in self.replacements:
+                    ending = ',\n' if line.endswith(',\n') else '\n'
+                    line = dumps(self.replacements[index],
+                                 ensure_ascii=False) + ending
+                target.write(line)
+            for line in source:
+                target.write(line)
+            target.flush()
+            fsync(target.fileno())
+        replace(patched_path, self.temp_path)
+        self.replacements = {}
+
+    def flush(self):
+        """
+        Flushes written map objects so that they are visible to readers of the
+        temporary file.
+        """
+        self.file.flush()
+
+    def close(self):
+        """
+        Finalizes the map file by atomically renaming the temporary file.
+        """
+        if self.map_format == 'json':
+            self.write_text('\n]' if self.count else ']')
+        self.file.flush()
+        fsync(self.file.fileno())
+        self.file.close()
+        if self.replacements:
+            self.apply_replacements()
+        replace(self.temp_path, self.path)
+
+    def abort(self):
+        """
+        Discards the temporary file without creating the map file.
+        """
+        self.file.close()
+        try:
+            remove(self.temp_path)
+        except OSError:
+            pass
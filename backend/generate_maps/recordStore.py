@@ -0,0 +1,152 @@
+"""
+This module contains a compact in-memory store of map objects, used to hold
+every business retrieved for a map while it is generated without the overhead
+of a dictionary and a coordinate list per business.
+
+Attributes are kept in parallel arrays indexed by sequence number:
+    - coordinates in packed float arrays, with NaN for missing coordinates
+    - business types interned in a string table and stored as ints
+    - addresses split at their first ", " into the street, kept as a string,
+        and the locality (city, state and postal code), interned in a string
+        table and stored as an int, since most businesses of a map share a
+        handful of localities
+    - names, phone numbers and websites as strings
+
+Records are converted back to map objects with attributes "n", "c", "a", "t",
+"p" and "w" (described in generateMapData.py) when they are read, or
+serialized to the same JSON as json.dumps(map_object, ensure_ascii=False)
+without creating the map object.
+
+Classes:
+    RecordStore: packed store of map objects
+"""
+from array import array
+from json import dumps
+from math import isnan, nan
+
+
+class RecordStore:
+    """
+    Packed store of map objects, addressed by sequence numbers in the order
+    they were appended.
+
+    Attributes:
+        lats: float array of latitudes (NaN if a record has no coordinates)
+        longs: float array of longitudes (NaN if a record has no coordinates)
+    """
+
+    def __init__(self):
+        self.lats = array('d')
+        self.longs = array('d')
+        self.names = []
+        self.streets = []
+        self.localities = array('I')
+        self.types = array('I')
+        self.phones = []
+        self.websites = []
+        self.strings = [None]
+        self.string_ids = {None: 0}
+
+    def __len__(self):
+        return len(self.names)
+
+    def __iter__(self):
+        for seq in range(len(self)):
+            yield self.get(seq)
+
+    def intern(self, text):
+        string_id = self.string_ids.get(text)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(text)
+            self.string_ids[text] = string_id
+        return string_id
+
+    def split_address(self, address):
+        if not address:
+            return address, 0
+        index = address.find(', ')
+        if index < 0:
+            return address, 0
+        return address[:index], self.intern(address[index + 2:])
+
+    def address(self, seq):
+        street = self.streets[seq]
+        locality = self.localities[seq]
+        if not locality:
+            return street
+        return f'{street}, {self.strings[locality]}'
+
+    def coords(self, seq):
+        """
+        Returns the [latitude, longitude] of a record, or None if it has no
+        coordinates.
+        """
+        lat = self.lats[seq]
+        if isnan(lat):
+            return None
+        return [lat, self.longs[seq]]
+
+    def append(self, map_object):
+        """
+        Appends a map object and returns its sequence number.
+        """
+        coords = map_object.get('c')
+        lat, long = coords if coords else (nan, nan)
+        street, locality = self.split_address(map_object.get('a'))
+        self.lats.append(lat)
+        self.longs.append(long)
+        self.names.append(map_object.get('n'))
+        self.streets.append(street)
+        self.localities.append(locality)
+        self.types.append(self.intern(map_object.get('t')))
+        self.phones.append(map_object.get('p'))
+        self.websites.append(map_object.get('w'))
+        return len(self.names) - 1
+
+    def set(self, seq, map_object):
+        """
+        Replaces the record at a sequence number with a map object.
+        """
+        coords = map_object.get('c')
+        if coords:
+            self.lats[seq], self.longs[seq] = coords
+        else:
+            self.lats[seq] = self.longs[seq] = nan
+        self.names[seq] = map_object.get('n')
+        self.streets[seq], self.localities[seq] = self.split_address(
+            map_object.get('a'))
+        self.types[seq] = self.intern(map_object.get('t'))
+        self.phones[seq] = map_object.get('p')
+        self.websites[seq] = map_object.get('w')
+
+    def get(self, seq):
+        """
+        Returns the map object dictionary of a record.
+        """
+        return {
+            'n': self.names[seq],
+            'c': self.coords(seq),
+            'a': self.address(seq),
+            't': self.strings[self.types[seq]],
+            'p': self.phones[seq],
+            'w': self.websites[seq]
+        }
+
+    def dumps(self, seq):
+        """
+        Returns the JSON text of the map object of a record, identical to
+        json.dumps(self.get(seq), ensure_ascii=False).
+        """
+        coords = self.coords(seq)
+        if coords is not None:
+            coords = f'[{coords[0]!r}, {coords[1]!r}]'
+        else:
+            coords = 'null'
+        name, address, business_type, phone, website = (
+            dumps(value, ensure_ascii=False) for value in (
+                self.names[seq], self.address(seq),
+                self.strings[self.types[seq]], self.phones[seq],
+                self.websites[seq]))
+        return (f'{{"n": {name}, "c": {coords}, "a": {address}, '
+                f'"t": {business_type}, "p": {phone}, "w": {website}}}')
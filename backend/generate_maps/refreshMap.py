@@ -0,0 +1,195 @@
+"""
+This module refreshes an existing map in place instead of regenerating it
+under a new map id.
+
+A refresh re-runs the generation plan saved by generateMapData.write_plan(),
+either for the whole map or only for selected search grids, then diffs the
+retrieved businesses against the stored map file by business identity (the
+same matching used by spatialDedup.DedupIndex). The map file is rewritten with
+only the changes applied:
+    - stored map objects outside the refreshed grids, or inside grids whose
+        requests failed, are kept unchanged
+    - stored map objects matched by a retrieved business are kept, or updated
+        if the business changed
+    - stored map objects inside the refreshed grids that were not retrieved
+        again are removed
+    - retrieved businesses inside the refreshed grids (and outside grids whose
+        requests failed) that match no stored map object are added
+The map keeps its id and its entry in the Map table. Progress events and the
+metrics summary of the refresh replace those of the previous job of the map.
+
+Refreshes are queued with map generation jobs by
+generateMapData.retrieve_job_scheduler().
+
+Cached responses younger than REFRESH_MAX_AGE are reused, so only stale grids
+are requested from the Bing Maps API again.
+
+Global Variables:
+    REFRESH_MAX_AGE: int for maximum age (s) of cached responses reused by a
+        refresh
+
+Functions:
+    refresh_map: refreshes a map file in place
+
+When invoked directly, the following input values are read to refresh a map.
+
+Input Values:
+    map_id: string representing the base-64 unique identifier for the map
+"""
+from asyncio import run, to_thread
+from generateMapData import (CACHE_MAX_BYTES, MAP_FORMAT, MAPS_PATH, MapJob,
+                             finalize_map, finish_summary, open_metrics,
+                             open_session, read_plan, retrieve_all,
+                             retrieve_api_key, retrieve_boundary,
+                             retrieve_job_scheduler, retrieve_response_cache,
+                             write_metrics, write_plan)
+from geocoder import geocode
+from jobMetrics import JobMetrics
+from mapFormats import iter_map_objects
+from mapWriter import MapWriter
+from os.path import join
+from time import time
+
+
+REFRESH_MAX_AGE = 24 * 60 * 60
+
+
+def in_grids(coords, grids):
+    if not coords:
+        return False
+    lat, long = coords
+    for sw_lat, sw_long, ne_lat, ne_long in grids:
+        if sw_lat <= lat <= ne_lat and sw_long <= long <= ne_long:
+            return True
+    return False
+
+
+def write_refreshed_map(map_path, map_format, job, grids, failed_grids):
+    """
+    Rewrites a map file with the businesses retrieved by a refresh job
+    applied, and returns the diff counts described in refresh_map().
+    """
+    def refreshed(coords):
+        return ((grids is None or in_grids(coords, grids)) and
+                not in_grids(coords, failed_grids))
+
+    diff = {'added': 0, 'updated': 0, 'removed': 0, 'unchanged': 0}
+    matched = set()
+    with MapWriter(map_path, map_format) as writer:
+        for stored_object in iter_map_objects(map_path):
+            seq = job.dedup.lookup(stored_object)
+            if not refreshed(stored_object.get('c')):
+                # Businesses retrieved again by a saturated parent request or
+                # just outside a requested grid are already in the map file
+                if seq is not None:
+                    matched.add(seq)
+                writer.write(stored_object)
+                diff['unchanged'] += 1
+                continue
+
+            if seq is None or seq in matched:
+                diff['removed'] += 1
+                continue
+
+            matched.add(seq)
+            current_object = job.dedup.get(seq)
+            if current_object == stored_object:
+                diff['unchanged'] += 1
+            else:
+                diff['updated'] += 1
+            writer.write(current_object)
+
+        # Added businesses are serialized straight from the record store
+        records = job.dedup.records
+        for seq in range(len(records)):
+            if seq not in matched and refreshed(records.coords(seq)):
+                writer.write_json(records.dumps(seq))
+                diff['added'] += 1
+
+    return diff
+
+
+async def refresh_map(map_id, session, grids=None):
+    """
+    Refreshes a map file in place.
+
+    Args:
+        map_id: string representing the base-64 unique identifier for the map.
+        session: aiohttp ClientSession returned by
+            generateMapData.open_session().
+        grids: a list or tuple of search grids (4 floats each, in the same
+            order as localSearch.search_grid()) to refresh. Refreshes the
+            whole map if not provided.
+
+    Returns:
+        A dictionary with integer counts for keys "added", "updated",
+        "removed" and "unchanged".
+
+    Raises:
+        ValueError: if the map has no generation plan or already has a queued
+            or running job.
+    """
+    plan = read_plan(map_id)
+    metrics = JobMetrics()
+    with metrics.stage('geocode'):
+        place = await geocode(plan['city'], plan['state'], session,
+                              retrieve_response_cache(), CACHE_MAX_BYTES)
+    boundary = retrieve_boundary(place) if place else None
+    # Checked before the events of a running job would be overwritten
+    job_scheduler = retrieve_job_scheduler()
+    job_scheduler.check_idle(map_id)
+    open_metrics(map_id, metrics)
+
+    if grids is not None:
+        grids = [tuple(grid) for grid in grids]
+    return await job_scheduler.run(
+        map_id, metrics,
+        run_refresh(map_id, plan, boundary, grids, session, metrics))
+
+
+async def run_refresh(map_id, plan, boundary, grids, session, metrics):
+    """
+    Retrieves the businesses of a refresh, rewrites the map file with them and
+    finalizes it, as described in refresh_map().
+    """
+    map_format = plan.get('format', MAP_FORMAT)
+    map_path = join(MAPS_PATH, f'{map_id}.{map_format}')
+
+    try:
+        # Collect the current businesses without writing them
+        job = MapJob(plan['types'], plan['boundingBox'], None, boundary,
+                     cache_ttl=REFRESH_MAX_AGE, metrics=metrics)
+        with metrics.stage('retrieve'):
+            await retrieve_all(job, session, grids)
+        print("Completed async requests")
+        failed_grids = [grid for grid, _, _ in job.failed_requests]
+        for grid, requested_type, reason in job.failed_requests:
+            print("Failed request", requested_type, grid, reason)
+
+        with metrics.stage('write'):
+            diff = await to_thread(write_refreshed_map, map_path, map_format,
+                                   job, grids, failed_grids)
+
+        plan['refreshed'] = time()
+        write_plan(map_id, plan)
+        with metrics.stage('finalize'):
+            await finalize_map(map_id, map_path, plan['boundingBox'])
+    finally:
+        generation = write_metrics(map_id, metrics)
+
+    await finish_summary(map_id, generation)
+
+    print("Finished map refresh", diff)
+    return diff
+
+
+async def main():
+    retrieve_api_key()
+    map_id = input()
+
+    async with open_session() as session:
+        await refresh_map(map_id, session)
+
+
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,366 @@
+"""
+This module contains a scheduler for Bing Maps API requests that runs requests
+as fast as the API allows without silently losing any of them.
+
+Requests can be spread over several API keys, each with its own budget: a
+token bucket that enforces a queries per second limit and a semaphore that
+bounds the number of requests in flight. Each attempt uses the usable key with
+the fewest outstanding attempts, and the key in the request url is replaced
+with it. A key that is throttled several times in a row is taken out of
+rotation for a cooldown, and a key that is rejected (invalid or out of quota)
+or reaches its request quota is taken out of rotation for good. Requests
+that fail with a retryable status (throttling, server errors), a network
+error or a malformed response body are retried with exponential backoff and
+full jitter. Once enough
+latencies have been observed, a request that runs past a latency percentile is
+hedged with a duplicate request and whichever finishes first is used. Requests
+that fail every retry raise RequestFailedError so callers can report them.
+
+Responses are decoded with orjson if the optional orjson package is installed,
+which is considerably faster than the json module.
+
+Bing Maps signals throttling either with status 429 or with a 200 response
+carrying the header "X-MS-BM-WS-INFO: 1" and no results. Both are retried.
+
+Global Variables:
+    RETRYABLE_STATUSES: set of HTTP statuses that are retried
+    REJECTED_KEY_STATUSES: set of HTTP statuses that mean an API key is
+        invalid or out of quota, retried with another key if one is usable
+    THROTTLED_HEADER: string for the Bing Maps header marking throttled
+        responses
+
+Classes:
+    RequestFailedError: raised when a request fails every retry
+    TokenBucket: asynchronous token bucket rate limiter
+    KeyBudget: rate limit, concurrency budget and usage of one API key
+    RequestScheduler: rate limited, retrying and hedging request runner
+"""
+from aiohttp import ClientError, ClientTimeout
+from asyncio import (FIRST_COMPLETED, Event, Semaphore, TimeoutError,
+                     create_task, sleep, wait)
+from collections import deque
+from random import uniform
+from re import sub
+from time import monotonic
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+REJECTED_KEY_STATUSES = {401, 403}
+THROTTLED_HEADER = 'X-MS-BM-WS-INFO'
+
+
+class RequestFailedError(Exception):
+    """
+    Raised when a request fails every retry or fails with a status that is
+    not retryable.
+    """
+
+    def __init__(self, url, reason):
+        super().__init__(reason)
+        self.url = url
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Asynchronous token bucket that admits at most rate acquisitions per second
+    on average, with bursts of up to capacity acquisitions.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = monotonic()
+
+    async def acquire(self):
+        while True:
+            now = monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await sleep((1 - self.tokens) / self.rate)
+
+
+class KeyBudget:
+    """
+    Rate limit, concurrency budget and usage of one API key.
+
+    Attributes:
+        key: string for the API key, or None to leave request urls unchanged
+        requests: int count of attempts made with the key
+        throttled: int count of throttled attempts made with the key
+        strikes: int count of consecutive throttled attempts
+        disabled_until: float for the monotonic time until which the key is
+            out of rotation, or None if it is usable
+        rejected: boolean for whether the key was taken out of rotation for
+            good
+    """
+
+    def __init__(self, key, qps, max_in_flight, quota=None):
+        self.key = key
+        self.bucket = TokenBucket(qps)
+        self.in_flight = Semaphore(max_in_flight)
+        self.quota = quota
+        self.outstanding = 0
+        self.requests = 0
+        self.throttled = 0
+        self.strikes = 0
+        self.disabled_until = None
+        self.rejected = False
+
+    def usable(self, now):
+        if self.rejected:
+            return False
+        return self.disabled_until is None or self.disabled_until <= now
+
+    def sign(self, url):
+        """
+        Returns url with its key parameter replaced by this key.
+        """
+        if self.key is None:
+            return url
+        return sub(r'([?&]key=)[^&]*', lambda match: match.group(1) + self.key,
+                   url)
+
+    def spend(self):
+        """
+        Counts an attempt made with the key, and takes the key out of
+        rotation for good once it reaches its quota.
+        """
+        self.requests += 1
+        if self.quota is not None and self.requests >= self.quota:
+            self.rejected = True
+
+    def record(self, status, strike_limit, cooldown):
+        """
+        Updates the usage of the key with the status of an attempt, and takes
+        the key out of rotation if needed.
+        """
+        if status in REJECTED_KEY_STATUSES:
+            self.rejected = True
+        elif status == 429:
+            self.throttled += 1
+            self.strikes += 1
+            if self.strikes >= strike_limit:
+                self.strikes = 0
+                self.disabled_until = monotonic() + cooldown
+        else:
+            self.strikes = 0
+
+
+class RequestScheduler:
+    """
+    Runs GET requests that return JSON under a shared rate limit and
+    concurrency budget per API key, retrying and hedging them as needed.
+
+    Attributes:
+        budgets: list of KeyBudget, one per API key
+        retries: int count of retried attempts
+        hedges: int count of hedged attempts
+        latencies: deque of the most recent successful attempt latencies (s)
+    """
+
+    def __init__(self,
+                 qps,
+                 max_in_flight,
+                 keys=None,
+                 key_quota=None,
+                 key_strike_limit=3,
+                 key_cooldown=60,
+                 max_retries=4,
+                 backoff_base=0.5,
+                 backoff_max=8,
+                 timeout=10,
+                 hedge_percentile=0.95,
+                 hedge_min_samples=20,
+                 latency_samples=200):
+        """
+        Args:
+            qps: integer or float representing the maximum average number of
+                requests started per second.
+            max_in_flight: integer representing the maximum number of
+                requests in flight at once, including hedges.
+            keys: a list or tuple of strings for the API keys that requests
+                are spread over. qps and max_in_flight apply to each key.
+                Request urls are used unchanged if not provided.
+            key_quota: integer representing the maximum number of attempts
+                made with each key, or None for no quota.
+            key_strike_limit: integer representing the number of
+                consecutive throttled attempts after which a key is taken out
+                of rotation.
+            key_cooldown: float representing the time (s) a throttled key is
+                out of rotation.
+            max_retries: integer representing the number of retries after the
+                first attempt.
+            backoff_base: float representing the backoff (s) before the first
+                retry. Doubles with each retry.
+            backoff_max: float representing the maximum backoff (s).
+            timeout: float representing the total timeout (s) of an attempt.
+            hedge_percentile: float between 0-1 representing the latency
+                percentile after which an attempt is hedged. None disables
+                hedging.
+            hedge_min_samples: integer representing the number of latencies
+                to observe before hedging.
+            latency_samples: integer representing the number of recent
+                latencies used to compute the hedging percentile.
+        """
+        self.budgets = [KeyBudget(key, qps, max_in_flight, key_quota)
+                        for key in (keys or (None,))]
+        self.key_strike_limit = key_strike_limit
+        self.key_cooldown = key_cooldown
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = ClientTimeout(total=timeout)
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.latencies = deque(maxlen=latency_samples)
+        self.retries = 0
+        self.hedges = 0
+
+    async def fetch(self, session, url, on_retry=None):
+        """
+        Requests a url, retrying retryable failures with exponential backoff.
+
+        Args:
+            session: aiohttp ClientSession used for the request.
+            url: string representing the request url.
+            on_retry: optional function called with the reason of the failed
+                attempt before each retry.
+
+        Returns:
+            A dictionary created from the JSON response.
+
+        Raises:
+            RequestFailedError: if every attempt failed or the response status
+                is not retryable.
+        """
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                if on_retry is not None:
+                    on_retry(reason)
+                await sleep(uniform(0, min(self.backoff_max,
+                                           self.backoff_base * 2 ** attempt)))
+            try:
+                status, results = await self.hedged_attempt(session, url)
+            except (ClientError, TimeoutError, ValueError) as err:
+                # ValueError is raised by a truncated or malformed JSON body
+                reason = repr(err)
+                continue
+
+            if status == 200:
+                return results
+            reason = f"HTTP {status}"
+            if status in REJECTED_KEY_STATUSES and any(
+                budget.usable(monotonic()) for budget in self.budgets
+            ):
+                continue
+            if status not in RETRYABLE_STATUSES:
+                break
+
+        raise RequestFailedError(url, reason)
+
+    def hedge_threshold(self):
+        """
+        Returns the latency (s) after which an attempt is hedged, or None if
+        hedging is disabled or too few latencies have been observed.
+        """
+        if (self.hedge_percentile is None or
+                len(self.latencies) < self.hedge_min_samples):
+            return None
+        latencies = sorted(self.latencies)
+        return latencies[int(self.hedge_percentile * (len(latencies) - 1))]
+
+    async def hedged_attempt(self, session, url):
+        threshold = self.hedge_threshold()
+        started = Event()
+        tasks = {create_task(self.attempt(session, url, started))}
+        waiter = None
+        try:
+            if threshold is not None:
+                # Time spent queued for the rate limit is not latency, so the
+                # threshold only counts once the attempt is in flight
+                waiter = create_task(started.wait())
+                await wait(tasks | {waiter}, return_when=FIRST_COMPLETED)
+                done, _ = await wait(tasks, timeout=threshold)
+                if not done:
+                    self.hedges += 1
+                    tasks.add(create_task(self.attempt(session, url)))
+
+            while tasks:
+                done, tasks = await wait(tasks, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            if waiter is not None:
+                waiter.cancel()
+            for task in tasks:
+                task.cancel()
+
+    async def choose_budget(self, url):
+        """
+        Returns the usable key budget with the fewest outstanding attempts,
+        waiting for a throttled key to come back if none is usable.
+
+        Raises:
+            RequestFailedError: if every key was taken out of rotation for
+                good.
+        """
+        while True:
+            now = monotonic()
+            usable = [budget for budget in self.budgets if budget.usable(now)]
+            if usable:
+                return min(usable, key=lambda budget: budget.outstanding)
+            cooling = [budget.disabled_until for budget in self.budgets
+                       if not budget.rejected]
+            if not cooling:
+                raise RequestFailedError(url, "No usable API key")
+            await sleep(min(cooling) - now)
+
+    async def attempt(self, session, url, started=None):
+        while True:
+            budget = await self.choose_budget(url)
+            budget.outstanding += 1
+            try:
+                await budget.bucket.acquire()
+                async with budget.in_flight:
+                    # The key may have been rejected, throttled or used up
+                    # while the attempt waited for a token and a slot
+                    if not budget.usable(monotonic()):
+                        continue
+                    if started is not None:
+                        started.set()
+                    start = monotonic()
+                    budget.spend()
+                    status, results = await self.request(session,
+                                                         budget.sign(url))
+                    if status == 200:
+                        self.latencies.append(monotonic() - start)
+            finally:
+                budget.outstanding -= 1
+            budget.record(status, self.key_strike_limit, self.key_cooldown)
+            return status, results
+
+    async def request(self, session, url):
+        async with session.get(url, timeout=self.timeout) as response:
+            status = response.status
+            if status == 200 and (
+                response.headers.get(THROTTLED_HEADER) == '1'
+            ):
+                return 429, None
+            if status != 200:
+                return status, None
+            return status, loads(await response.read())
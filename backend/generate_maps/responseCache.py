@@ -0,0 +1,172 @@
+"""
+This module contains methods to assist with caching Bing Maps Local Search API
+responses in a local SQLite database.
+
+Responses are keyed on the normalized request rather than the raw URL. The API
+key is stripped out, business types are sorted, and userMapView coordinates
+are rounded to a tolerance so that nearly identical search grids from
+overlapping maps share entries. Entries expire after a configurable TTL, and
+the least recently used entries are evicted once the cache exceeds its byte
+budget. The total size of cached responses is kept in a one-row table that
+triggers update on every insert, update and delete, so enforcing the budget
+does not scan every response. Cached responses are decoded with orjson if the
+optional orjson package is installed.
+
+Functions:
+    open_cache: opens (and creates if needed) the response cache database
+    cache_key: normalizes a Local Search API request url into a cache key
+    cache_get: returns a cached response for a request if one is fresh
+    cache_put: stores a response for a request and enforces the byte budget
+    cache_size: returns the total size in bytes of all cached responses
+"""
+from json import dumps
+from sqlite3 import connect
+from time import time
+from urllib.parse import parse_qsl, urlsplit
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+
+def open_cache(path):
+    """
+    Opens the response cache database, creating its table if needed.
+
+    Args:
+        path: string representing the file path for the SQLite database.
+
+    Returns:
+        A sqlite3.Connection for the response cache.
+    """
+    db = connect(path)
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS Response (key TEXT PRIMARY KEY, " +
+        "body TEXT, size INTEGER, created REAL, accessed REAL)")
+    db.execute(
+        "CREATE INDEX IF NOT EXISTS ResponseAccessed ON Response (accessed)")
+    db.execute("CREATE TABLE IF NOT EXISTS ResponseSize (total INTEGER)")
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS ResponseInsert AFTER INSERT ON " +
+        "Response BEGIN UPDATE ResponseSize SET total = total + new.size; END")
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS ResponseUpdate AFTER UPDATE OF size " +
+        "ON Response BEGIN UPDATE ResponseSize SET total = total + " +
+        "new.size - old.size; END")
+    db.execute(
+        "CREATE TRIGGER IF NOT EXISTS ResponseDelete AFTER DELETE ON " +
+        "Response BEGIN UPDATE ResponseSize SET total = total - old.size; END")
+    # Caches created before the running total start from a full count
+    db.execute(
+        "INSERT INTO ResponseSize (total) SELECT COALESCE(SUM(size), 0) " +
+        "FROM Response WHERE NOT EXISTS (SELECT 1 FROM ResponseSize)")
+    db.commit()
+    return db
+
+
+def cache_key(url, precision=4):
+    """
+    Normalizes a Local Search API request url into a cache key.
+
+    Args:
+        url: string representing a url created by
+            localSearch.construct_request().
+        precision: integer representing the number of decimal places that
+            userMapView, userCircularMapView and userLocation coordinates are
+            rounded to.
+
+    Returns:
+        A string uniquely identifying the request, without its API key.
+    """
+    params = []
+    for name, value in parse_qsl(urlsplit(url).query):
+        if name == 'key':
+            continue
+        if name == 'type':
+            value = ','.join(sorted(value.split(',')))
+        elif name in ('userMapView', 'userCircularMapView', 'userLocation'):
+            value = ','.join(
+                f"{float(coordinate):.{precision}f}"
+                for coordinate in value.split(',')
+            )
+        params.append((name, value))
+
+    return '&'.join(f"{name}={value}" for name, value in sorted(params))
+
+
+def cache_get(db, key, ttl):
+    """
+    Retrieves a cached response and marks it as recently used.
+
+    Args:
+        db: sqlite3.Connection returned by open_cache().
+        key: string returned by cache_key().
+        ttl: integer or float representing the maximum age (s) of a cached
+            response.
+
+    Returns:
+        A dictionary created from the cached JSON response, or None if the
+        response is not cached or has expired.
+    """
+    now = time()
+    row = db.execute(
+        "SELECT body, created FROM Response WHERE key = ?", (key,)
+    ).fetchone()
+    if row is None:
+        return None
+
+    body, created = row
+    if now - created > ttl:
+        db.execute("DELETE FROM Response WHERE key = ?", (key,))
+        db.commit()
+        return None
+
+    db.execute("UPDATE Response SET accessed = ? WHERE key = ?", (now, key))
+    db.commit()
+    return loads(body)
+
+
+def cache_put(db, key, response, max_bytes):
+    """
+    Stores a response, then evicts least recently used responses until the
+    cache fits within its byte budget.
+
+    Args:
+        db: sqlite3.Connection returned by open_cache().
+        key: string returned by cache_key().
+        response: dictionary created from a Local Search API JSON response.
+        max_bytes: integer representing the byte budget for all cached
+            responses.
+    """
+    now = time()
+    body = dumps(response, ensure_ascii=False)
+    # An upsert rather than INSERT OR REPLACE, whose implicit delete does not
+    # fire the delete trigger
+    db.execute(
+        "INSERT INTO Response (key, body, size, created, accessed) " +
+        "VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET " +
+        "body = excluded.body, size = excluded.size, " +
+        "created = excluded.created, accessed = excluded.accessed",
+        (key, body, len(body.encode('utf-8')), now, now)
+    )
+
+    total = cache_size(db)
+    if total > max_bytes:
+        evicted = []
+        for evict_key, size in db.execute(
+            "SELECT key, size FROM Response ORDER BY accessed"
+        ).fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append((evict_key,))
+            total -= size
+        db.executemany("DELETE FROM Response WHERE key = ?", evicted)
+    db.commit()
+
+
+def cache_size(db):
+    """
+    Returns the total size in bytes of all cached responses.
+    """
+    return db.execute("SELECT total FROM ResponseSize").fetchone()[0]
@@ -0,0 +1,82 @@
+"""
+This module resumes the generation of a map that crashed or was killed
+partway through, for example when the worker process was restarted during a
+long job.
+
+A resume re-runs the generation plan saved by generateMapData.write_plan()
+under the same map id. Requests recorded in the journal of the map
+({id}.journal.jsonl, see mapJournal.py) are replayed from it, so only the
+search grids that had not completed are requested from the Bing Maps API. The
+map file is then written from scratch and finalized as by
+generateMapData.generate_map(), and the journal is removed. Like new maps,
+resumed maps are queued by generateMapData.retrieve_job_scheduler(). Progress
+events and the metrics summary of the resumed job replace those of the
+interrupted job.
+
+Functions:
+    resume_map: resumes the generation of a map
+
+When invoked directly, the following input values are read to resume a map.
+
+Input Values:
+    map_id: string representing the base-64 unique identifier for the map
+"""
+from asyncio import run
+from generateMapData import (CACHE_MAX_BYTES, MAP_FORMAT, MAPS_PATH,
+                             open_metrics, open_session, read_plan,
+                             retrieve_api_key, retrieve_boundary,
+                             retrieve_job_scheduler, retrieve_response_cache,
+                             write_map)
+from geocoder import geocode
+from jobMetrics import JobMetrics
+from os.path import isfile, join
+
+
+async def resume_map(map_id, session):
+    """
+    Resumes the generation of a map.
+
+    Args:
+        map_id: string representing the base-64 unique identifier for the map.
+        session: aiohttp ClientSession returned by
+            generateMapData.open_session().
+
+    Returns:
+        An integer count of map objects in the finalized map file.
+
+    Raises:
+        ValueError: if the map has no generation plan, was already generated
+            or already has a queued or running job.
+    """
+    plan = read_plan(map_id)
+    map_format = plan.get('format', MAP_FORMAT)
+    journal_path = join(MAPS_PATH, f'{map_id}.journal.jsonl')
+    map_path = join(MAPS_PATH, f'{map_id}.{map_format}')
+    if isfile(map_path) and not isfile(journal_path):
+        raise ValueError(f"Map {map_id} was already generated")
+
+    metrics = JobMetrics()
+    with metrics.stage('geocode'):
+        place = await geocode(plan['city'], plan['state'], session,
+                              retrieve_response_cache(), CACHE_MAX_BYTES)
+    boundary = retrieve_boundary(place) if place else None
+    # Checked before the events of a running job would be overwritten
+    job_scheduler = retrieve_job_scheduler()
+    job_scheduler.check_idle(map_id)
+    open_metrics(map_id, metrics)
+
+    writer = await job_scheduler.run(
+        map_id, metrics, write_map(map_id, plan, boundary, session, metrics))
+    return writer.count
+
+
+async def main():
+    retrieve_api_key()
+    map_id = input()
+
+    async with open_session() as session:
+        await resume_map(map_id, session)
+
+
+if __name__ == '__main__':
+    run(main())
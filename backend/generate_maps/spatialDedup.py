@@ -0,0 +1,243 @@
+"""
+This module contains a spatial index that detects duplicate map objects, such
+as the same business returned for overlapping search grids or business types.
+
+Map objects are indexed in a hash grid of coordinate cells at least as large as
+the merge distance, so each lookup only compares against the map objects in the
+3 x 3 cells around it. Two map objects are duplicates if they are within the
+merge distance of each other and have equal normalized names or equal
+normalized addresses. Map objects without coordinates are only matched by
+normalized address.
+
+When a duplicate is found, the more complete map object (the one with more
+non-empty attributes) is kept, and any attributes it is missing are filled in
+from the other one.
+
+Global Variables:
+    METERS_PER_DEGREE: float for the approximate meters per degree of latitude
+    CELL_KEY_FACTOR: int that hash grid cell rows are multiplied by to key
+        cells by a single int
+    ADDRESS_ABBREVIATIONS: dictionary mapping address words to the
+        abbreviation they are normalized to
+
+Functions:
+    normalize_text: normalizes a name or address for comparison
+    text_key: hashes a normalized name or address for comparison
+    completeness: scores how many attributes of a map object are non-empty
+
+Classes:
+    DedupIndex: hash grid index of map objects used to detect duplicates
+"""
+from array import array
+from math import cos, floor, hypot, radians
+from recordStore import RecordStore
+from unicodedata import category, normalize
+
+
+METERS_PER_DEGREE = 111320
+CELL_KEY_FACTOR = 1 << 32
+ADDRESS_ABBREVIATIONS = {
+    'street': 'st', 'avenue': 'ave', 'road': 'rd', 'boulevard': 'blvd',
+    'drive': 'dr', 'lane': 'ln', 'court': 'ct', 'place': 'pl',
+    'highway': 'hwy', 'parkway': 'pkwy', 'suite': 'ste', 'north': 'n',
+    'south': 's', 'east': 'e', 'west': 'w'
+}
+
+
+def normalize_text(text, abbreviations=None):
+    """
+    Normalizes a name or address for comparison by removing accents,
+    punctuation, case and repeated whitespace.
+
+    Args:
+        text: string to normalize, or None.
+        abbreviations: dictionary mapping words to the word they are replaced
+            with, such as ADDRESS_ABBREVIATIONS.
+
+    Returns:
+        The normalized string, or None if text is empty.
+    """
+    if not text:
+        return None
+    text = ''.join(
+        character if category(character)[0] in 'LN' else ' '
+        for character in normalize('NFKD', text.lower())
+        if category(character) != 'Mn'
+    )
+    words = text.split()
+    if abbreviations:
+        words = [abbreviations.get(word, word) for word in words]
+    return ' '.join(words) or None
+
+
+def text_key(text):
+    """
+    Returns a nonzero int hash of a normalized text, or 0 if it is None.
+    """
+    if text is None:
+        return 0
+    return hash(text) or 1
+
+
+def completeness(map_object):
+    """
+    Returns the number of non-empty attributes of a map object.
+    """
+    return sum(1 for value in map_object.values() if value)
+
+
+def merge(preferred, other):
+    """
+    Returns a copy of preferred with its empty attributes filled in from other.
+    """
+    merged = dict(preferred)
+    for key, value in other.items():
+        if not merged.get(key) and value:
+            merged[key] = value
+    return merged
+
+
+class DedupIndex:
+    """
+    Hash grid index of map objects. Each added map object is assigned a
+    sequence number in the order it was first added, which stays the same when
+    a more complete duplicate replaces it.
+
+    Map objects are kept in a recordStore.RecordStore, their normalized names
+    and addresses only as hashes, and the map objects of each cell as a linked
+    list threaded through an array, so that the index of a large map stays
+    small. Hash collisions between different normalized texts of nearby map
+    objects are negligible.
+
+    Attributes:
+        records: recordStore.RecordStore of the kept map objects, by sequence
+            number
+        count: int count of distinct map objects
+        duplicates: int count of duplicates detected
+    """
+
+    def __init__(self, distance, reference_latitude=0):
+        """
+        Args:
+            distance: float representing the merge distance (m).
+            reference_latitude: float representing the highest absolute
+                latitude of the indexed region, used to size longitude cells.
+        """
+        self.distance = distance
+        self.lat_size = distance / METERS_PER_DEGREE
+        self.long_size = self.lat_size / max(
+            cos(radians(min(abs(reference_latitude), 89))), 0.01)
+        self.cells = {}
+        self.addresses = {}
+        self.records = RecordStore()
+        self.name_keys = array('q')
+        self.address_keys = array('q')
+        self.next_in_cell = array('i')
+        self.count = 0
+        self.duplicates = 0
+
+    def cell_for(self, lat, long):
+        return (floor(lat / self.lat_size), floor(long / self.long_size))
+
+    def cell_key(self, cell_lat, cell_long):
+        # Cells are keyed by a single int rather than a tuple to save memory
+        return cell_lat * CELL_KEY_FACTOR + cell_long
+
+    def is_near(self, seq, lat, long):
+        lat_meters = (self.records.lats[seq] - lat) * METERS_PER_DEGREE
+        long_meters = ((self.records.longs[seq] - long) * METERS_PER_DEGREE *
+                       cos(radians(lat)))
+        return hypot(lat_meters, long_meters) <= self.distance
+
+    def find(self, lat, long, name_key, address_key):
+        """
+        Returns the sequence number of an indexed duplicate, or None.
+        """
+        if lat is None:
+            return self.addresses.get(address_key) if address_key else None
+
+        cell_lat, cell_long = self.cell_for(lat, long)
+        for neighbor_lat in (cell_lat - 1, cell_lat, cell_lat + 1):
+            for neighbor_long in (cell_long - 1, cell_long, cell_long + 1):
+                seq = self.cells.get(
+                    self.cell_key(neighbor_lat, neighbor_long), -1)
+                while seq >= 0:
+                    if self.is_near(seq, lat, long) and (
+                        (name_key and name_key == self.name_keys[seq]) or
+                        (address_key and
+                         address_key == self.address_keys[seq])
+                    ):
+                        return seq
+                    seq = self.next_in_cell[seq]
+        return None
+
+    def keys(self, map_object):
+        coords = map_object.get('c')
+        lat, long = coords if coords else (None, None)
+        return (lat,
+                long,
+                text_key(normalize_text(map_object.get('n'))),
+                text_key(normalize_text(map_object.get('a'),
+                                        ADDRESS_ABBREVIATIONS)))
+
+    def lookup(self, map_object):
+        """
+        Returns the sequence number of the indexed duplicate of a map object,
+        or None if it has none. The index is not modified.
+        """
+        return self.find(*self.keys(map_object))
+
+    def get(self, seq):
+        """
+        Returns the map object kept for a sequence number.
+        """
+        return self.records.get(seq)
+
+    def add(self, map_object):
+        """
+        Adds a map object to the index unless it duplicates an indexed one.
+
+        Args:
+            map_object: map object dictionary with attributes "n", "c", "a",
+                "t", "p" and "w".
+
+        Returns:
+            A tuple (status, seq, map_object), where status is "new" if the
+            map object was added, "duplicate" if an indexed duplicate was
+            kept, or "replaced" if the indexed duplicate should be replaced by
+            the returned merged map object. seq is the sequence number of the
+            map object or the duplicate it matched.
+        """
+        lat, long, name_key, address_key = self.keys(map_object)
+
+        seq = self.find(lat, long, name_key, address_key)
+        if seq is None:
+            seq = self.records.append(map_object)
+            self.name_keys.append(name_key)
+            self.address_keys.append(address_key)
+            if lat is not None:
+                cell = self.cell_key(*self.cell_for(lat, long))
+                self.next_in_cell.append(self.cells.get(cell, -1))
+                self.cells[cell] = seq
+            else:
+                self.next_in_cell.append(-1)
+            if address_key and address_key not in self.addresses:
+                self.addresses[address_key] = seq
+            self.count += 1
+            return ('new', seq, map_object)
+
+        self.duplicates += 1
+        kept = self.records.get(seq)
+        if completeness(map_object) > completeness(kept):
+            merged = merge(map_object, kept)
+        else:
+            merged = merge(kept, map_object)
+        if merged == kept:
+            return ('duplicate', seq, kept)
+
+        self.records.set(seq, merged)
+        self.name_keys[seq] = self.name_keys[seq] or name_key
+        if not self.address_keys[seq] and address_key:
+            self.address_keys[seq] = address_key
+            self.addresses.setdefault(address_key, seq)
+        return ('replaced', seq, merged)
@@ -10,12 +10,12 @@ from localSearch import validate_request_parameters
 
 
 def verify_map_inputs(city, state, title, types, maxResults, key, tcp_limit,
-                      nominatim_response):
+                      place):
     validate_request_parameters(types=types, maxResults=maxResults, key=key)
 
     if not tcp_limit or not (1 <= tcp_limit <= 5):
         raise ValueError("tcp_limit must be between 1-5")
     if not city or not state or not title:
         raise ValueError("city, state, and title must be provided")
-    if not nominatim_response:
+    if not place:
         raise ValueError("nominatim request failed, check city and state")
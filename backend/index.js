@@ -1,12 +1,13 @@
 import express from 'express'
+import fs from 'fs'
 import helmet from 'helmet'
 import path, { dirname } from 'path'
 import { PythonShell } from 'python-shell'
 import { fileURLToPath } from 'url'
 
 const __dirname = dirname(fileURLToPath(import.meta.url))
-const createMapPath = path.join(__dirname, 'generate_maps', 'generateMapData.py')
-const indexHandlerPath = path.join(__dirname, 'generate_maps', 'mapIndexHandler.py')
+const workerPath = path.join(__dirname, 'generate_maps', 'mapWorker.py')
+const mapsPath = path.join(__dirname, 'generate_maps', 'maps')
 
 const app = express()
 app.use(express.json())
@@ -14,29 +15,172 @@ app.use(helmet())
 
 const baseURL = "/api"
 
-// get map index
-app.get(baseURL + "/maps", (req, res) => {
-    var pyshell = new PythonShell(indexHandlerPath, { pythonOptions: ["-u"] });
-    pyshell.send("GET")
+// long-lived mapWorker.py process shared by all requests
+var worker = null
+var nextCommandId = 0
+const pendingCommands = new Map()
 
+const startWorker = () => {
+    worker = new PythonShell(workerPath, { mode: "json", pythonOptions: ["-u"] })
+
+    worker.on("message", function (reply) {
+        const pending = pendingCommands.get(reply.id)
+        if (!pending) return
+        pendingCommands.delete(reply.id)
+        if (reply.ok) pending.resolve(reply.result)
+        else pending.reject(new Error(reply.error))
+    })
+    worker.on("stderr", function (message) { console.log(message) })
+    worker.on("error", function (err) { console.log(err) })
+    worker.on("close", () => {
+        worker = null
+        for (const pending of pendingCommands.values()) {
+            pending.reject(new Error("Map worker exited"))
+        }
+        pendingCommands.clear()
+    })
+}
+
+// send a command to the worker and resolve with its result
+const runCommand = (command) => new Promise((resolve, reject) => {
+    if (!worker) startWorker()
+    const id = nextCommandId++
+    pendingCommands.set(id, { resolve, reject })
+    worker.send({ id: id, ...command })
+})
+
+// get map index, optionally paginated with ?limit=&after= and filtered with ?prefix=
+app.get(baseURL + "/maps", async (req, res) => {
+    const options = {
+        "limit": req.query.limit ? parseInt(req.query.limit) : null,
+        "after": req.query.after || null,
+        "titlePrefix": req.query.prefix || null
+    }
+
+    try {
+        return res.json(await runCommand({ mode: "GET", ...options }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.json("Map index get failed")
+    }
+})
+
+// get map index entry for a specific map
+app.get(baseURL + "/maps/:id/info", async (req, res) => {
     try {
-        pyshell.on("message", function (message) { return res.json(JSON.parse(message)) })
-        pyshell.end(function (err) { if (err) console.log(err) })
+        const entry = await runCommand({ mode: "MAP", mapId: req.params.id })
+        if (!entry) return res.status(404).json("Map not found")
+        return res.json(entry)
     }
     catch (err) {
+        console.log(err)
         return res.json("Map index get failed")
     }
 })
 
+// send a map file, preferring a precompressed sibling the client accepts
+const sendMapFile = (req, res, fileName, contentType) => {
+    const filePath = path.join(mapsPath, fileName)
+    res.header("Content-Type", contentType)
+    res.header("Vary", "Accept-Encoding")
+    for (const [encoding, extension] of [["br", ".br"], ["gzip", ".gz"]]) {
+        if (req.acceptsEncodings(encoding) && fs.existsSync(filePath + extension)) {
+            res.header("Content-Encoding", encoding)
+            return res.sendFile(filePath + extension)
+        }
+    }
+    return res.sendFile(filePath)
+}
+
 // get specific map file
 app.get(baseURL + "/maps/:id", (req, res) => {
+    const mapId = req.params.id
+    sendMapFile(req, res, mapId + '.json', 'application/json')
+})
+
+// get tile pyramid index of a specific map (see mapTiles.py)
+app.get(baseURL + "/maps/:id/tiles", (req, res) => {
     const mapId = req.params.id
     res.header("Content-Type", 'application/json')
-    res.sendFile(path.join(__dirname, 'generate_maps', 'maps', mapId + '.json'))
+    res.sendFile(path.join(mapsPath, mapId + '.tiles', 'index.json'))
+})
+
+// get a single tile of a specific map
+app.get(baseURL + "/maps/:id/tiles/:z/:x/:y", (req, res) => {
+    const { id, z, x, y } = req.params
+    if (![z, x, y].every((value) => /^\d+$/.test(value))) return res.status(400).json("Invalid tile")
+    res.header("Content-Type", 'application/json')
+    res.sendFile(path.join(mapsPath, id + '.tiles', z, x, y + '.json'))
+})
+
+// query map objects of a specific map (see mapQuery.py), filtered with
+// ?bbox=swLat,swLong,neLat,neLong&types=&text= and paginated with ?limit=&after=
+app.get(baseURL + "/maps/:id/query", async (req, res) => {
+    const boundingBox = req.query.bbox ? req.query.bbox.split(",").map(parseFloat) : null
+    if (boundingBox && (boundingBox.length !== 4 || boundingBox.some(isNaN))) {
+        return res.status(400).json("Invalid bounding box")
+    }
+    const options = {
+        "boundingBox": boundingBox,
+        "businessTypes": req.query.types || null,
+        "text": req.query.text || null,
+        "limit": req.query.limit ? parseInt(req.query.limit) : null,
+        "after": req.query.after ? parseInt(req.query.after) : null
+    }
+
+    try {
+        return res.json(await runCommand({ mode: "QUERY", mapId: req.params.id, ...options }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.json("Map query failed")
+    }
+})
+
+// get summary of a specific map (counts by type and locality, phone and
+// website coverage, density histogram and generation stats, see mapSummary.py)
+app.get(baseURL + "/maps/:id/summary", async (req, res) => {
+    try {
+        return res.json(await runCommand({ mode: "SUMMARY", mapId: req.params.id }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.status(404).json("Map summary not found")
+    }
+})
+
+// get status (queued, running, percent complete and ETA) of the latest
+// generation job of a specific map
+app.get(baseURL + "/maps/:id/status", async (req, res) => {
+    try {
+        return res.json(await runCommand({ mode: "STATUS", mapId: req.params.id }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.status(404).json("Map job not found")
+    }
+})
+
+// get status of every queued, running and recently finished generation job
+app.get(baseURL + "/jobs", async (req, res) => {
+    try {
+        return res.json(await runCommand({ mode: "STATUS" }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.json("Job status failed")
+    }
+})
+
+// get specific map file in the columnar format (see mapFormats.py)
+app.get(baseURL + "/maps/:id/columnar", (req, res) => {
+    const mapId = req.params.id
+    sendMapFile(req, res, mapId + '.cmap', 'application/octet-stream')
 })
 
 // create map with generateMapData.py
-app.post(baseURL + "/maps", (req, res) => {
+app.post(baseURL + "/maps", async (req, res) => {
     const values = {
         "city": req.body.city,
         "state": req.body.state,
@@ -44,53 +188,72 @@ app.post(baseURL + "/maps", (req, res) => {
         "businessTypes": req.body.businessTypes
     }
 
-    var pyshell = new PythonShell(createMapPath, { pythonOptions: ["-u"] });
-    for (const value of Object.values(values)) pyshell.send(value)
-
     try {
-        pyshell.on("message", function (message) { console.log(message) })
-        pyshell.end(function (err) { if (err) console.log(err) })
-        pyshell.on("close", () => { return res.json("Map generated successfully") })
+        // with wait false, reply with the map id once the job is queued
+        if (req.body.wait === false) {
+            return res.json({ mapId: await runCommand({ mode: "CREATE", ...values, wait: false }) })
+        }
+        await runCommand({ mode: "CREATE", ...values })
+        return res.json("Map generated successfully")
     }
     catch (err) {
+        console.log(err)
         return res.json("Map generation failed")
     }
 })
 
+// refresh map in place with refreshMap.py, optionally only for the given grids
+app.post(baseURL + "/maps/:id/refresh", async (req, res) => {
+    const mapId = req.params.id
+    const grids = req.body.grids || null
+
+    try {
+        return res.json(await runCommand({ mode: "REFRESH", mapId: mapId, grids: grids }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.json("Map refresh failed")
+    }
+})
+
+// resume an interrupted map generation with resumeMap.py
+app.post(baseURL + "/maps/:id/resume", async (req, res) => {
+    const mapId = req.params.id
+
+    try {
+        return res.json(await runCommand({ mode: "RESUME", mapId: mapId }))
+    }
+    catch (err) {
+        console.log(err)
+        return res.json("Map resume failed")
+    }
+})
+
 // update map with mapIndexHandler.py
-app.put(baseURL + "/maps/:id", (req, res) => {
+app.put(baseURL + "/maps/:id", async (req, res) => {
     const mapId = req.params.id
     const newTitle = req.body.newTitle
 
-    var pyshell = new PythonShell(indexHandlerPath, { pythonOptions: ["-u"] })
-    pyshell.send("UPDATE")
-    pyshell.send(mapId)
-    pyshell.send(newTitle)
-
     try {
-        pyshell.on("message", function (message) { console.log(message) })
-        pyshell.end(function (err) { if (err) console.log(err) })
-        pyshell.on("close", () => { return res.json("Map updated successfully") })
+        await runCommand({ mode: "UPDATE", mapId: mapId, newTitle: newTitle })
+        return res.json("Map updated successfully")
     }
     catch (err) {
+        console.log(err)
         return res.json("Map update failed")
     }
 })
 
 // delete map with mapIndexHandler.py
-app.delete(baseURL + "/maps/:id", (req, res) => {
+app.delete(baseURL + "/maps/:id", async (req, res) => {
     const mapId = req.params.id
 
-    var pyshell = new PythonShell(indexHandlerPath, { pythonOptions: ["-u"] })
-    pyshell.send("DELETE")
-    pyshell.send(mapId)
-
     try {
-        pyshell.on("message", function (message) { console.log(message) })
-        pyshell.end(function (err) { if (err) console.log(err) })
-        pyshell.on("close", () => { return res.json("Map deleted successfully") })
+        await runCommand({ mode: "DELETE", mapId: mapId })
+        return res.json("Map deleted successfully")
     }
     catch (err) {
+        console.log(err)
         return res.json("Map delete failed")
     }
 })
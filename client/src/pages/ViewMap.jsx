@@ -19,6 +19,7 @@ const ViewMap = () => {
   const [mapLocation, setMapLocation] = useState({ lat: null, lng: null });
   const [mapBounds, setMapBounds] = useState([[null, null], [null, null]]);
   const [mapTitle, setMapTitle] = useState("");
+  const [mapSummary, setMapSummary] = useState(null);
   const [map, setMap] = useState(null);
   const markerBounds = latLngBounds([]);
   const padding = { padding: [20, 20] };
@@ -35,20 +36,27 @@ const ViewMap = () => {
 
     const fetchMapLocationAndTitle = async (id) => {
       try {
-        const res = await axios.get("/api/maps")
-        res.data.forEach(element => {
-          if (element.id == id) {
-            setMapLocation({
-              'lat': element.location[0],
-              'lng': element.location[1]
-            })
-            setMapBounds([
-              [element.bounds[0], element.bounds[1]],
-              [element.bounds[2], element.bounds[3]]
-            ])
-            setMapTitle(element.title)
-          }
+        const res = await axios.get("/api/maps/" + id + "/info")
+        const element = res.data
+        setMapLocation({
+          'lat': element.location[0],
+          'lng': element.location[1]
         })
+        setMapBounds([
+          [element.bounds[0], element.bounds[1]],
+          [element.bounds[2], element.bounds[3]]
+        ])
+        setMapTitle(element.title)
+      } catch (err) {
+        console.log(err)
+      }
+    }
+
+    // Precomputed counts, so the chart does not depend on the map file
+    const fetchMapSummary = async (id) => {
+      try {
+        const res = await axios.get("/api/maps/" + id + "/summary")
+        setMapSummary(res.data)
       } catch (err) {
         console.log(err)
       }
@@ -56,6 +64,7 @@ const ViewMap = () => {
 
     fetchMap(mapId)
     fetchMapLocationAndTitle(mapId)
+    fetchMapSummary(mapId)
   }, []);
 
   // Zoom in/out button
@@ -97,10 +106,11 @@ const ViewMap = () => {
     mapBounds[0][0] && mapBounds[0][1] && mapBounds[1][0] && mapBounds[1][1]
   ) {
 
-    const typeRatios = {};
+    const typeRatios = mapSummary && mapSummary.types ? mapSummary.types : {};
 
     mapData.forEach(element => {
       markerBounds.extend(element.c)
+      if (mapSummary && mapSummary.types) return
       let type = element.t
       if (typeRatios.hasOwnProperty(type)) {
         typeRatios[type]++